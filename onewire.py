@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import asyncio
 import logging
 
 
@@ -22,6 +23,11 @@ class ds18b20:
         if temp_string is not None:
             self.temperature = float(temp_string) / 1000.0
             return self.temperature
+
+    async def read_temperature_async(self) -> float:
+        """Read the temperature in a worker thread, the 1-Wire read blocks for
+        close to a second."""
+        return await asyncio.to_thread(self.read_temperature)
         
     def __str__(self) -> str:
         return f"Device ID: {self.device_id}, Temperature: {self.temperature:.2f} °C"
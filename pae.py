@@ -8,7 +8,7 @@
 # Author:  Peter Malmberg <peter.malmberg@gmail.com>
 # Date:
 # Version: 0.3
-# Python:  >=3
+# Python:  >=3.9
 # License: MIT
 #
 # ---------------------------------------------------------------------------
@@ -16,18 +16,26 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from enum import Enum
-from math import sin
+from collections import deque
+from heapq import heapify, heappop, heappush, merge
+from math import sin, pi
 import time
 import logging
 from escape import Ansi
 
-from random import random
+from random import Random
+from types import MemberDescriptorType
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-# class PaeFType(Enum):
-#     MovingAverage = 0
-#     IIR = 1
-#     FIR = 2
+
+class PaeFType(Enum):
+    MovingAverage = 0
+    IIR = 1
+    FIR = 2
 
 
 string_with_html = """
@@ -47,17 +55,103 @@ string_with_html = """
 
 @dataclass
 class PaeFilter:
+    """Filter over the last len samples.
+
+    MovingAverage keeps a ring buffer and a running sum, IIR is a first order
+    low pass with alpha = 2 / (len + 1) unless alpha is given and FIR applies
+    taps (default len equal taps) to the buffer, newest sample first.
+    """
+
     len: int = 10
+    ftype: PaeFType = PaeFType.MovingAverage
+    taps: list = None
+    alpha: float = 0.0
 
     def __post_init__(self):
-        self.data = []
+        if self.ftype == PaeFType.FIR and self.taps is not None:
+            self.len = len(self.taps)
+        self.len = max(int(self.len), 1)
+        self.pos = 0
+        self.count = 0
+        self.sum = 0.0
+        self.out = 0.0
+
+        if self.alpha <= 0.0:
+            self.alpha = 2.0 / (self.len + 1)
+
+        if self.ftype == PaeFType.FIR:
+            taps = self.taps if self.taps is not None else [1.0 / self.len] * self.len
+            # Samples are written twice so the window is always one contiguous
+            # slice, oldest first, which is why the taps are reversed.
+            if np is not None:
+                self.kernel = np.array(taps[::-1], dtype=float)
+                self.data = np.zeros(2 * self.len)
+            else:
+                self.kernel = list(taps[::-1])
+                self.data = [0.0] * (2 * self.len)
+        else:
+            self.data = [0.0] * self.len
+
+        self.update = {
+            PaeFType.MovingAverage: self.moving_average,
+            PaeFType.IIR: self.iir,
+            PaeFType.FIR: self.fir,
+        }[self.ftype]
 
-    def update(self, new_val: float) -> float:
-        self.data.append(new_val)
-        if len(self.data) > self.len:
-            self.data.pop(0)
+    def get_state(self) -> list[float]:
+        return [self.pos, self.count, self.sum, self.out] + [float(x) for x in self.data]
 
-        return sum(self.data) / len(self.data)
+    def set_state(self, state: list[float]) -> None:
+        if len(state) != 4 + len(self.data):
+            logging.warning("Filter state does not match filter length, not restored")
+            return
+        self.pos, self.count = int(state[0]), int(state[1])
+        self.sum, self.out = state[2], state[3]
+        self.data[:] = state[4:]
+
+    def moving_average(self, new_val: float) -> float:
+        pos = self.pos
+        self.sum += new_val - self.data[pos]
+        self.data[pos] = new_val
+        pos += 1
+        if pos == self.len:
+            pos = 0
+            # Start over from the buffer to keep rounding errors from piling up
+            self.sum = sum(self.data)
+        self.pos = pos
+        if self.count < self.len:
+            self.count += 1
+
+        return self.sum / self.count
+
+    def iir(self, new_val: float) -> float:
+        if self.count == 0:
+            self.out = new_val
+            self.count = 1
+        else:
+            self.out += self.alpha * (new_val - self.out)
+        return self.out
+
+    def fir(self, new_val: float) -> float:
+        pos = self.pos
+        self.data[pos] = new_val
+        self.data[pos + self.len] = new_val
+        pos += 1
+        if pos == self.len:
+            pos = 0
+        self.pos = pos
+
+        window = self.data[pos:pos + self.len]
+        if np is not None:
+            return float(np.dot(self.kernel, window))
+        return sum(k * x for k, x in zip(self.kernel, window))
+
+
+class PaeWrite(Enum):
+    """How writes to a node within one tick combine."""
+
+    Last = 0
+    Accumulate = 1
 
 
 class PaeType(Enum):
@@ -76,6 +170,7 @@ class PaeType(Enum):
     Multiply = 12
     Division = 13
     Multiply_Add = 14
+    PID = 15
 
     Absolute = 40
     Above = 41
@@ -92,16 +187,26 @@ class PaeType(Enum):
     Alarm_between = 203
 
 
-@dataclass
 class PaeObject:
-    tick: int = 0
-    enabled: bool = True
-    #   id: str = ""
-    name: str = ""
-    desc: str = ""
-    unit: str = ""
-    # plot: bool = True
-    src_id: str = ""
+    __slots__ = ("tick", "enabled", "name", "desc", "unit", "src_id")
+
+    def __init__(
+        self,
+        tick: int = 0,
+        enabled: bool = True,
+        name: str = "",
+        desc: str = "",
+        unit: str = "",
+        src_id: str = "",
+    ) -> None:
+        self.tick = tick
+        self.enabled = enabled
+        #   self.id = ""
+        self.name = name
+        self.desc = desc
+        self.unit = unit
+        # self.plot = True
+        self.src_id = src_id
 
     def enable(self, en: bool) -> None:
         self.enabled = en
@@ -123,16 +228,105 @@ class PaeObject:
         return self.name
 
     def set_description(self, description) -> None:
-        self.description = description
+        self.desc = description
 
     def get_description(self) -> str:
-        return self.description
+        return self.desc
 
     def update(self) -> None:
         pass
 
 
+class PaeConstant:
+    """Constant operand, read through the same value interface as a PaeNode."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: float = 0.0) -> None:
+        self.value = value
+
+    def get_value(self) -> float:
+        return self.value
+
+
+# Constants are never written, so operands with the same value share one.
+constants = {}
+
+
+def operand(d) -> PaeNode | PaeConstant:
+    """Resolve an operand parameter to an object with a value attribute."""
+    if isinstance(d, (PaeNode, PaeConstant)):
+        return d
+    if d is None or isinstance(d, str):
+        d = 0.0
+    d = float(d)
+    c = constants.get(d)
+    if c is None:
+        c = constants[d] = PaeConstant(d)
+    return c
+
+
 class PaeNode(PaeObject):
+    """Node in a PaeMotor graph.
+
+    PaeNode(type=...) creates the subclass registered for the type in
+    node_classes. Each subclass only stores the parameters its type uses,
+    reading any other parameter gives its default and assigning it raises
+    AttributeError. Assigning an operand takes effect on the next update().
+    """
+
+    __slots__ = (
+        "id",
+        "value",
+        "type",
+        "source",
+        "new_value",
+        "motor",
+        "interval",
+        "_index",
+        "invalid",
+        "no_data",
+        "out_of_range",
+    )
+
+    # Parameters stored by the node type, operands are resolved by initiate()
+    params = ()
+    operands = ()
+    # Value changes over time even when the inputs are unchanged
+    live = False
+    # Evaluating the node on its own value leaves it unchanged once it has
+    # been evaluated, nodes without source that are not idempotent are
+    # evaluated every tick in incremental mode, like live nodes
+    idempotent = False
+
+    last = 0.0
+    stamp = None
+    max_limit = 0.0
+    min_limit = 0.0
+    term = 0.0
+    factor = 1.0
+    offset = 0.0
+    threshold = 0.0
+    period = 1.0
+    amplitude = 1.0
+    average = 1
+    divider = 1.0
+    setpoint = 0.0
+    kp = 1.0
+    ki = 0.0
+    kd = 0.0
+    tf = 0.0
+    manual = 0.0
+    hysteresis = 0.0
+    on_delay = 0.0
+    off_delay = 0.0
+
+    def __new__(cls, *args, **kwargs):
+        if cls is PaeNode:
+            type = kwargs.get("type", args[3] if len(args) > 3 else PaeType.Normal)
+            cls = node_classes.get(type, PaeNode)
+        return super().__new__(cls)
+
     def __init__(
         self,
         id: str = "",
@@ -153,50 +347,111 @@ class PaeNode(PaeObject):
         average: int = 1,
         divider: float = 1.0,
         trigger: bool = False,
+        ftype: PaeFType = PaeFType.MovingAverage,
+        taps: list = None,
+        interval: float = 0.0,
+        setpoint: float = 0.0,
+        kp: float = 1.0,
+        ki: float = 0.0,
+        kd: float = 0.0,
+        tf: float = 0.0,
+        manual: float = 0.0,
+        hysteresis: float = 0.0,
+        on_delay: float = 0.0,
+        off_delay: float = 0.0,
     ) -> None:
-        super().__init__(name=name)
+        super().__init__(name=name, desc=desc)
         self.id = id
         self.value = 0.0
-        self.last = 0.0
         self.type = type
         self.source = source
+        self.new_value = None
+        self.motor = None
+        self.interval = interval
+        self._index = 0
         self.invalid = False
         self.no_data = False
         self.out_of_range = False
-        self.max_limit = max_limit
-        self.min_limit = min_limit
-        self.term = term
-        self.offset = offset
-        self.factor = factor
-        self.threshold = threshold
-        self.period = period
-        self.amplitude = amplitude
-        self.average = average
-        self.divider = divider
-        self._trigger = trigger
-        self.new_value = None
+        self.setup(
+            dict(
+                max_limit=max_limit,
+                min_limit=min_limit,
+                term=term,
+                factor=factor,
+                offset=offset,
+                threshold=threshold,
+                period=period,
+                amplitude=amplitude,
+                average=average,
+                divider=divider,
+                trigger=trigger,
+                ftype=ftype,
+                taps=taps,
+                setpoint=setpoint,
+                kp=kp,
+                ki=ki,
+                kd=kd,
+                tf=tf,
+                manual=manual,
+                hysteresis=hysteresis,
+                on_delay=on_delay,
+                off_delay=off_delay,
+            )
+        )
 
-        if self.type == PaeType.Average:
-            self.filter = PaeFilter(self.average)
+    def setup(self, params: dict) -> None:
+        for name in self.params:
+            setattr(self, name, params[name])
+
+    def parameters(self) -> dict:
+        """Constructor parameters stored by the node type."""
+        return {name: getattr(self, name) for name in self.params}
 
     def get_id(self) -> str:
         return self.id
 
+    def get_state(self) -> tuple:
+        """Runtime state kept by checkpoints."""
+        return (self.value,)
+
+    def set_state(self, state: tuple) -> None:
+        self.value = state[0]
+        if self.motor is not None:
+            self.motor.mark_changed(self, "set_state", state)
+
     def get_value(self) -> float:
         return self.value
 
     def set_value(self, value: float) -> None:
-        self.new_value = value
+        """Set the value on the next tick, safe to call from any thread when
+        the node is added to a motor."""
+        if self.motor is not None:
+            self.motor.writes.append((self, value))
+        else:
+            self.new_value = value
+
+    def enable(self, en: bool) -> None:
+        super().enable(en)
+        if self.motor is not None:
+            self.motor.mark_dirty(self)
+
+    def subscribe(self, callback, deadband: float = 0.0, interval: float = 0.0) -> PaeSubscription:
+        """Subscribe to changes of the node, see PaeMotor.subscribe()."""
+        if self.motor is None:
+            raise ValueError(f"Node '{self.id}' is not added to a motor")
+        return self.motor.subscribe(self, callback, deadband, interval)
 
     def get(self, d) -> float:
         if type(d) is float:
             return d
 
-        if type(d) is PaeNode:
+        if isinstance(d, PaeNode):
             return d.get_value()
 
     def set_source(self, source: PaeNode) -> None:
         self.source = source
+        if self.motor is not None:
+            self.motor.plan = None
 
     def get_source(self) -> PaeNode:
         return self.source
@@ -208,186 +463,966 @@ class PaeNode(PaeObject):
         return self.get_source().is_enabled()
 
     def trigger(self) -> None:
-        if self.type == PaeType.CountDownTimer:
-            self._trigger = True
+        pass
 
-    def update(self) -> None:
-        super().update()
+    def dependencies(self) -> list[PaeNode]:
+        """Nodes read by this node, source first."""
+        deps = []
+        if isinstance(self.source, PaeNode):
+            deps.append(self.source)
+        for name in self.operands:
+            d = getattr(self, name)
+            if isinstance(d, PaeNode) and d not in deps:
+                deps.append(d)
+        return deps
+
+    def compile(self) -> None:
+        """Resolve the operands of the node type.
+
+        Must be called again when an operand is changed, PaeMotor does this
+        in initiate().
+        """
+        for name in self.operands:
+            setattr(self, f"_{name}", operand(getattr(self, name)))
+        if self.motor is not None:
+            self.motor.mark_changed(self, "compile")
 
-        if self.is_enabled() is False:
+    def update(self) -> None:
+        if not self.enabled:
             return
 
         if self.new_value is not None:
             self.value = self.new_value
-            logging.debug(f"New value set: {self.new_value} ")
+            logging.debug("New value set: %s", self.new_value)
             self.new_value = None
 
-        sv = self.value
+        if self.source is None:
+            self.evaluate(self.value)
+        else:
+            self.evaluate(self.source.value)
 
-        if self.source is not None:
-            sv = self.source.get_value()
+    def evaluate(self, sv: float) -> None:
+        pass
 
-        if self.type == PaeType.Normal:
-            self.value = sv
-            logging.debug(f"Normal value set: {self.value} ")
-        elif self.type == PaeType.Min:
-            if sv < self.value:
-                self.value = sv
+    def __str__(self) -> str:
+
+        if self.is_enabled() is True:
+            enabled = "E"
+        else:
+            enabled = "D"
+
+        if self.source_enabled() is False:
+            n_src = "SD"
+        else:
+            n_src = "  "
+
+        return (
+            f"{self.get_name():24} {self.id:10} {self.type.name:16} {self.value:10.3f}  {enabled:1} {n_src:2}"
+        )
 
-        elif self.type == PaeType.Max:
-            if sv > self.value:
-                self.value = sv
 
-        elif self.type == PaeType.Counter:
-            if self.source.value > 0.5 and self.last < 0.5:
-                self.value += 1
+class PaeNormalNode(PaeNode):
+    __slots__ = ()
+    idempotent = True
 
-            self.last = self.source.value
+    def evaluate(self, sv: float) -> None:
+        self.value = sv
 
-        elif self.type == PaeType.Average:
-            self.value = self.filter.update(sv)
 
-        elif self.type == PaeType.Sine:
-            sv = self.get(self.amplitude) * sin(self.tick / 20) + self.get(self.offset)
+class PaeMinNode(PaeNode):
+    __slots__ = ()
+    idempotent = True
+
+    def evaluate(self, sv: float) -> None:
+        if sv < self.value:
             self.value = sv
-            self.tick += 1
 
-        elif self.type == PaeType.Square:
-            if self.tick > 0:
-                self.value = 1
-            else:
-                self.value = 0
-            self.tick += 1
-            if self.tick > self.get(self.period):
-                self.tick = -self.get(self.period)
-            # if self.tick > 5:
-            #     self.tick = -5
-
-        elif self.type == PaeType.Random:
-            self.value = self.offset + (self.factor * random())
-
-        elif self.type == PaeType.Limit:
-            if sv > self.max_limit:
-                self.value = self.max_limit
-                return
-            if sv < self.min_limit:
-                self.value = self.min_limit
-                return
+
+class PaeMaxNode(PaeNode):
+    __slots__ = ()
+    idempotent = True
+
+    def evaluate(self, sv: float) -> None:
+        if sv > self.value:
             self.value = sv
 
-        elif self.type == PaeType.RateLimit:
-            self.last = self.source.value
 
-        elif self.type == PaeType.Multiply:
-            self.value = sv * self.get(self.factor)
+class PaeCounterNode(PaeNode):
+    __slots__ = ("last",)
 
-        elif self.type == PaeType.Division:
-            self.value = sv / self.get(self.divider)
+    def setup(self, params: dict) -> None:
+        self.last = 0.0
 
-        elif self.type == PaeType.Multiply_Add:
-            self.value = sv * self.get(self.factor) + self.get(self.term)
+    def get_state(self) -> tuple:
+        return (self.value, self.last)
 
-        elif self.type == PaeType.Subtract:
-            self.value = sv - self.get(self.term)
+    def set_state(self, state: tuple) -> None:
+        super().set_state(state)
+        self.last = state[1]
 
-        elif self.type == PaeType.Addition:
-            self.value = sv + self.get(self.term)
+    def evaluate(self, sv: float) -> None:
+        if sv > 0.5 and self.last < 0.5:
+            self.value += 1
 
-        elif self.type == PaeType.Absolute:
-            self.value = abs(sv)
+        self.last = sv
 
-        elif self.type == PaeType.Above:
-            if sv > self.threshold:
-                self.value = 1
-            else:
-                self.value = 0
 
-        elif self.type == PaeType.Below:
-            if sv < self.threshold:
-                self.value = 1
-            else:
-                self.value = 0
+class PaeAverageNode(PaeNode):
+    __slots__ = ("average", "filter")
+    params = ("average",)
+    live = True
 
-        elif self.type == PaeType.CountDownTimer:
+    def setup(self, params: dict) -> None:
+        super().setup(params)
+        self.filter = PaeFilter(self.average, params["ftype"], params["taps"])
 
-            if self.value > 0:
-                self.value -= 1
+    def parameters(self) -> dict:
+        return dict(super().parameters(), ftype=self.filter.ftype, taps=self.filter.taps)
 
-            if self._trigger is True:
-                self.value = 200
-                self._trigger = False
+    def get_state(self) -> tuple:
+        return (self.value, *self.filter.get_state())
 
-            self.last = sv
+    def set_state(self, state: tuple) -> None:
+        super().set_state(state)
+        self.filter.set_state(list(state[1:]))
 
-    def __str__(self) -> str:
+    def evaluate(self, sv: float) -> None:
+        self.value = self.filter.update(sv)
 
-        if self.is_enabled() is True:
-            enabled = "E"
+
+class PaeSineNode(PaeNode):
+    """Sine wave of the motor time with the given period in seconds."""
+
+    __slots__ = ("amplitude", "offset", "period", "_amplitude", "_offset", "_period")
+    params = operands = ("amplitude", "offset", "period")
+    live = True
+
+    def evaluate(self, sv: float) -> None:
+        phase = 2 * pi * self.motor.time / self._period.value
+        self.value = self._amplitude.value * sin(phase) + self._offset.value
+
+
+class PaeSquareNode(PaeNode):
+    """Square wave of the motor time, low for the first half of each period
+    of the given length in seconds."""
+
+    __slots__ = ("period", "_period")
+    params = operands = ("period",)
+    live = True
+
+    def evaluate(self, sv: float) -> None:
+        period = self._period.value
+        if self.motor.time % period >= period / 2:
+            self.value = 1
         else:
-            enabled = "D"
+            self.value = 0
 
-        if self.source_enabled() is False:
-            n_src = "SD"
+
+class PaeRandomNode(PaeNode):
+    """Random value from offset to offset plus factor, drawn from the
+    generator of the motor so a seeded motor repeats the same values."""
+
+    __slots__ = ("factor", "offset", "_factor", "_offset")
+    params = operands = ("factor", "offset")
+    live = True
+
+    def evaluate(self, sv: float) -> None:
+        self.value = self._offset.value + (self._factor.value * self.motor.rng.random())
+
+
+class PaeLimitNode(PaeNode):
+    __slots__ = ("max_limit", "min_limit", "_max_limit", "_min_limit")
+    params = operands = ("max_limit", "min_limit")
+    idempotent = True
+
+    def evaluate(self, sv: float) -> None:
+        if sv > self._max_limit.value:
+            self.value = self._max_limit.value
+        elif sv < self._min_limit.value:
+            self.value = self._min_limit.value
         else:
-            n_src = "  "
+            self.value = sv
 
-        return (
-            f"{self.get_name():24} {self.id:10} {self.type.name:16} {self.value:10.3f}  {enabled:1} {n_src:2}"
+
+class PaeTimedNode(PaeNode):
+    """Node using the motor time elapsed since its last evaluation.
+
+    Time passed while the node is disabled is not counted.
+    """
+
+    __slots__ = ("stamp",)
+    live = True
+
+    def setup(self, params: dict) -> None:
+        super().setup(params)
+        self.stamp = None
+
+    def set_state(self, state: tuple) -> None:
+        super().set_state(state)
+        self.stamp = self.motor.time if self.motor is not None else 0.0
+
+    def enable(self, en: bool) -> None:
+        super().enable(en)
+        self.stamp = None
+
+    def elapsed(self) -> float:
+        """Seconds since the last evaluation, None on the first one."""
+        now = self.motor.time
+        stamp = self.stamp
+        self.stamp = now
+        return None if stamp is None else now - stamp
+
+
+class PaeIntegrateNode(PaeTimedNode):
+    """Integral of the source times factor over the motor time.
+
+    When max_limit is above min_limit the integral is held within them, so
+    it does not wind up while the output is saturated.
+    """
+
+    __slots__ = ("factor", "max_limit", "min_limit", "_factor", "_max_limit", "_min_limit")
+    params = operands = ("factor", "max_limit", "min_limit")
+
+    def evaluate(self, sv: float) -> None:
+        dt = self.elapsed()
+        if dt is None:
+            return
+
+        value = self.value + self._factor.value * sv * dt
+        hi, lo = self._max_limit.value, self._min_limit.value
+        if hi > lo:
+            if value > hi:
+                value = hi
+            elif value < lo:
+                value = lo
+        self.value = value
+
+
+class PaeDerivateNode(PaeTimedNode):
+    """Rate of change of the source per second, times factor."""
+
+    __slots__ = ("factor", "_factor", "last")
+    params = operands = ("factor",)
+
+    def setup(self, params: dict) -> None:
+        super().setup(params)
+        self.last = 0.0
+
+    def get_state(self) -> tuple:
+        return (self.value, self.last)
+
+    def set_state(self, state: tuple) -> None:
+        super().set_state(state)
+        self.last = state[1]
+
+    def evaluate(self, sv: float) -> None:
+        dt = self.elapsed()
+        if dt:
+            self.value = self._factor.value * (sv - self.last) / dt
+        self.last = sv
+
+
+class PaeRateLimitNode(PaeTimedNode):
+    """Follows the source, rising at most max_limit and falling at most
+    min_limit units per second. A limit of 0 or less does not limit."""
+
+    __slots__ = ("max_limit", "min_limit", "_max_limit", "_min_limit")
+    params = operands = ("max_limit", "min_limit")
+
+    def evaluate(self, sv: float) -> None:
+        dt = self.elapsed()
+        if dt is None:
+            self.value = sv
+            return
+
+        step = sv - self.value
+        up, down = self._max_limit.value, self._min_limit.value
+        if up > 0 and step > up * dt:
+            step = up * dt
+        elif down > 0 and step < -down * dt:
+            step = -down * dt
+        self.value += step
+
+
+class PaePidTune:
+    """State of a relay feedback autotune of a PID node."""
+
+    __slots__ = (
+        "bias",
+        "step",
+        "hysteresis",
+        "cycles",
+        "high",
+        "start",
+        "pv_max",
+        "pv_min",
+        "periods",
+        "amplitudes",
+    )
+
+    def __init__(self, bias: float, step: float, hysteresis: float, cycles: int) -> None:
+        self.bias = bias
+        self.step = step
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.high = False
+        self.start = None
+        self.pv_max = self.pv_min = 0.0
+        self.periods = []
+        self.amplitudes = []
+
+
+class PaePidNode(PaeTimedNode):
+    """PID controller with the source as process variable.
+
+    The output is clamped between min_limit and max_limit when max_limit is
+    above min_limit, the integral is reduced by what the output is clamped
+    so it does not wind up. The derivative acts on the process variable and
+    is low pass filtered with time constant tf seconds. While manual is
+    above 0.5 the output is left to set_value() and the integral tracks it,
+    as on the first evaluation, so switching to automatic is bumpless.
+    """
+
+    __slots__ = (
+        "setpoint",
+        "kp",
+        "ki",
+        "kd",
+        "tf",
+        "manual",
+        "max_limit",
+        "min_limit",
+        "_setpoint",
+        "_kp",
+        "_ki",
+        "_kd",
+        "_tf",
+        "_manual",
+        "_max_limit",
+        "_min_limit",
+        "integral",
+        "derivative",
+        "last",
+        "tune",
+    )
+    params = operands = ("setpoint", "kp", "ki", "kd", "tf", "manual", "max_limit", "min_limit")
+
+    def setup(self, params: dict) -> None:
+        super().setup(params)
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.last = 0.0
+        self.tune = None
+
+    def get_state(self) -> tuple:
+        return (self.value, self.integral, self.derivative, self.last)
+
+    def set_state(self, state: tuple) -> None:
+        super().set_state(state)
+        self.integral, self.derivative, self.last = state[1:4]
+
+    def autotune(self, step: float, hysteresis: float = 0.0, cycles: int = 4) -> None:
+        """Find the gains with a relay feedback test.
+
+        The output switches between its current value plus and minus step
+        as the process variable crosses the setpoint, hysteresis away from
+        it. After cycles oscillations the ultimate gain and period are taken
+        from all but the first one and the gains are set by the
+        Ziegler-Nichols rules.
+        """
+        self.tune = PaePidTune(self.value, step, hysteresis, max(int(cycles), 2))
+        if self.motor is not None:
+            self.motor.mark_changed(self, "autotune", step, hysteresis, cycles)
+
+    def tune_output(self, error: float, pv: float, now: float) -> float:
+        t = self.tune
+        if t.high and error < -t.hysteresis:
+            t.high = False
+        elif not t.high and error > t.hysteresis:
+            t.high = True
+            if t.start is not None:
+                t.periods.append(now - t.start)
+                t.amplitudes.append((t.pv_max - t.pv_min) / 2)
+            t.start = now
+            t.pv_max = t.pv_min = pv
+
+        if pv > t.pv_max:
+            t.pv_max = pv
+        elif pv < t.pv_min:
+            t.pv_min = pv
+
+        if len(t.periods) >= t.cycles:
+            self.tune = None
+            self.tune_done(t)
+            return t.bias
+
+        out = t.bias + t.step if t.high else t.bias - t.step
+        hi, lo = self._max_limit.value, self._min_limit.value
+        if hi > lo:
+            out = min(max(out, lo), hi)
+        return out
+
+    def tune_done(self, t: PaePidTune) -> None:
+        periods, amplitudes = t.periods[1:], t.amplitudes[1:]
+        amplitude = sum(amplitudes) / len(amplitudes)
+        if amplitude <= 0:
+            logging.warning(f"PID {self.id}: autotune saw no oscillation, gains unchanged")
+            return
+
+        tu = sum(periods) / len(periods)
+        ku = 4 * t.step / (pi * amplitude)
+        self.kp = 0.6 * ku
+        self.ki = 1.2 * ku / tu
+        self.kd = 0.075 * ku * tu
+        self.compile()
+        logging.info(
+            f"PID {self.id}: Ku {ku:.4g} Tu {tu:.4g} s, kp {self.kp:.4g} ki {self.ki:.4g} kd {self.kd:.4g}"
         )
 
+    def evaluate(self, sv: float) -> None:
+        dt = self.elapsed()
+        error = self._setpoint.value - sv
+        kp = self._kp.value
+
+        if self.tune is not None and dt is not None:
+            self.value = self.tune_output(error, sv, self.stamp)
+            self.integral = self.value - kp * error
+            self.derivative = 0.0
+        elif dt is None or self._manual.value > 0.5:
+            self.integral = self.value - kp * error
+            self.derivative = 0.0
+        elif dt > 0:
+            raw = (self.last - sv) / dt
+            tf = self._tf.value
+            if tf > 0:
+                self.derivative += dt / (tf + dt) * (raw - self.derivative)
+            else:
+                self.derivative = raw
+
+            self.integral += self._ki.value * error * dt
+            out = kp * error + self.integral + self._kd.value * self.derivative
+            hi, lo = self._max_limit.value, self._min_limit.value
+            if hi > lo:
+                if out > hi:
+                    self.integral -= out - hi
+                    out = hi
+                elif out < lo:
+                    self.integral -= out - lo
+                    out = lo
+            self.value = out
+        self.last = sv
+
+
+class PaeMultiplyNode(PaeNode):
+    __slots__ = ("factor", "_factor")
+    params = operands = ("factor",)
+
+    def evaluate(self, sv: float) -> None:
+        self.value = sv * self._factor.value
+
+
+class PaeDivisionNode(PaeNode):
+    __slots__ = ("divider", "_divider")
+    params = operands = ("divider",)
+
+    def evaluate(self, sv: float) -> None:
+        self.value = sv / self._divider.value
+
+
+class PaeMultiplyAddNode(PaeNode):
+    __slots__ = ("factor", "term", "_factor", "_term")
+    params = operands = ("factor", "term")
+
+    def evaluate(self, sv: float) -> None:
+        self.value = sv * self._factor.value + self._term.value
+
+
+class PaeSubtractNode(PaeNode):
+    __slots__ = ("term", "_term")
+    params = operands = ("term",)
+
+    def evaluate(self, sv: float) -> None:
+        self.value = sv - self._term.value
+
+
+class PaeAdditionNode(PaeNode):
+    __slots__ = ("term", "_term")
+    params = operands = ("term",)
+
+    def evaluate(self, sv: float) -> None:
+        self.value = sv + self._term.value
+
+
+class PaeAbsoluteNode(PaeNode):
+    __slots__ = ()
+    idempotent = True
+
+    def evaluate(self, sv: float) -> None:
+        self.value = abs(sv)
+
+
+class PaeAboveNode(PaeNode):
+    __slots__ = ("threshold", "_threshold")
+    params = operands = ("threshold",)
+
+    def evaluate(self, sv: float) -> None:
+        if sv > self._threshold.value:
+            self.value = 1
+        else:
+            self.value = 0
+
+
+class PaeBelowNode(PaeNode):
+    __slots__ = ("threshold", "_threshold")
+    params = operands = ("threshold",)
+
+    def evaluate(self, sv: float) -> None:
+        if sv < self._threshold.value:
+            self.value = 1
+        else:
+            self.value = 0
+
+
+class PaeCountDownTimerNode(PaeNode):
+    __slots__ = ("last", "_trigger")
+    live = True
+
+    def setup(self, params: dict) -> None:
+        self.last = 0.0
+        self._trigger = params["trigger"]
+
+    def trigger(self) -> None:
+        self._trigger = True
+        if self.motor is not None:
+            self.motor.mark_changed(self, "trigger")
+
+    def get_state(self) -> tuple:
+        return (self.value, self.last, float(self._trigger))
+
+    def set_state(self, state: tuple) -> None:
+        super().set_state(state)
+        self.last = state[1]
+        self._trigger = state[2] != 0.0
+
+    def evaluate(self, sv: float) -> None:
+        if self.value > 0:
+            self.value -= 1
+
+        if self._trigger is True:
+            self.value = 200
+            self._trigger = False
+
+        self.last = sv
+
+
+class PaeAlarmNode(PaeNode):
+    """Alarm on the source, value 1 while raised.
+
+    The alarm is raised when the raise condition has held for on_delay
+    seconds and cleared when the clear condition, hysteresis away from the
+    limit, has held for off_delay seconds. Transitions are reported to the
+    alarm log of the motor, if it has one.
+    """
+
+    __slots__ = ("hysteresis", "on_delay", "off_delay", "_hysteresis", "_on_delay", "_off_delay", "since")
+    params = operands = ("hysteresis", "on_delay", "off_delay")
+    live = True
+
+    def setup(self, params: dict) -> None:
+        super().setup(params)
+        self.since = None
+
+    def raised(self, sv: float) -> bool:
+        return False
+
+    def cleared(self, sv: float) -> bool:
+        return True
+
+    def evaluate(self, sv: float) -> None:
+        if self.value < 0.5:
+            change = self.raised(sv)
+            delay = self._on_delay.value
+        else:
+            change = self.cleared(sv)
+            delay = self._off_delay.value
+
+        if not change:
+            self.since = None
+            return
+
+        now = self.motor.time
+        if self.since is None:
+            self.since = now
+        if now - self.since >= delay:
+            self.since = None
+            self.value = 0.0 if self.value >= 0.5 else 1.0
+            if self.motor.alarm_log is not None:
+                self.motor.alarm_log.event(self, sv)
+
+
+class PaeAlarmAboveNode(PaeAlarmNode):
+    __slots__ = ("threshold", "_threshold")
+    params = operands = PaeAlarmNode.params + ("threshold",)
+
+    def raised(self, sv: float) -> bool:
+        return sv > self._threshold.value
+
+    def cleared(self, sv: float) -> bool:
+        return sv < self._threshold.value - self._hysteresis.value
+
+
+class PaeAlarmBelowNode(PaeAlarmNode):
+    __slots__ = ("threshold", "_threshold")
+    params = operands = PaeAlarmNode.params + ("threshold",)
+
+    def raised(self, sv: float) -> bool:
+        return sv < self._threshold.value
+
+    def cleared(self, sv: float) -> bool:
+        return sv > self._threshold.value + self._hysteresis.value
+
+
+class PaeAlarmBetweenNode(PaeAlarmNode):
+    """Alarm raised while the source is between min_limit and max_limit."""
+
+    __slots__ = ("max_limit", "min_limit", "_max_limit", "_min_limit")
+    params = operands = PaeAlarmNode.params + ("max_limit", "min_limit")
+
+    def raised(self, sv: float) -> bool:
+        return self._min_limit.value < sv < self._max_limit.value
+
+    def cleared(self, sv: float) -> bool:
+        h = self._hysteresis.value
+        return sv < self._min_limit.value - h or sv > self._max_limit.value + h
+
+
+node_classes = {
+    PaeType.Normal: PaeNormalNode,
+    PaeType.Min: PaeMinNode,
+    PaeType.Max: PaeMaxNode,
+    PaeType.Counter: PaeCounterNode,
+    PaeType.Average: PaeAverageNode,
+    PaeType.Sine: PaeSineNode,
+    PaeType.Square: PaeSquareNode,
+    PaeType.Random: PaeRandomNode,
+    PaeType.Limit: PaeLimitNode,
+    PaeType.Integrate: PaeIntegrateNode,
+    PaeType.Derivate: PaeDerivateNode,
+    PaeType.RateLimit: PaeRateLimitNode,
+    PaeType.PID: PaePidNode,
+    PaeType.Multiply: PaeMultiplyNode,
+    PaeType.Division: PaeDivisionNode,
+    PaeType.Multiply_Add: PaeMultiplyAddNode,
+    PaeType.Subtract: PaeSubtractNode,
+    PaeType.Addition: PaeAdditionNode,
+    PaeType.Absolute: PaeAbsoluteNode,
+    PaeType.Above: PaeAboveNode,
+    PaeType.Below: PaeBelowNode,
+    PaeType.CountDownTimer: PaeCountDownTimerNode,
+    PaeType.Alarm_above: PaeAlarmAboveNode,
+    PaeType.Alarm_below: PaeAlarmBelowNode,
+    PaeType.Alarm_between: PaeAlarmBetweenNode,
+}
+
+
+def operand_property(name: str, slot) -> property:
+    """Operand stored in slot, resolved again when assigned. The motor is
+    compiled again on its next update, a node operand can change the
+    evaluation order."""
+
+    def get(node: PaeNode):
+        return slot.__get__(node)
+
+    def set(node: PaeNode, value) -> None:
+        slot.__set__(node, value)
+        setattr(node, f"_{name}", operand(value))
+        if node.motor is not None:
+            node.motor.plan = None
+
+    return property(get, set)
+
+
+for cls in node_classes.values():
+    for name in cls.operands:
+        for owner in cls.__mro__:
+            slot = owner.__dict__.get(name)
+            if isinstance(slot, MemberDescriptorType):
+                setattr(owner, name, operand_property(name, slot))
+                break
+
+
+class PaeSubscription:
+    """Callback on changes of a node, see PaeMotor.subscribe()."""
+
+    __slots__ = ("node", "callback", "deadband", "interval", "value", "enabled", "time")
+
+    def __init__(self, node: PaeNode, callback, deadband: float, interval: float) -> None:
+        self.node = node
+        self.callback = callback
+        self.deadband = deadband
+        self.interval = interval
+        self.value = node.value
+        self.enabled = node.enabled
+        self.time = float("-inf")
+
 
 class PaeMotor(PaeObject):
-    def __init__(self) -> None:
+    def __init__(self, incremental: bool = False, clock=time.monotonic) -> None:
         super().__init__()
+        self.clock = clock
+        self.start = None
+        self.time = 0.0
         self.nodes = []
         self.first_run = False
         self.plots = []
+        self.plan = None
+        self.order = []
+        self.incremental = incremental
+        self.rank = {}
+        self.dependents = []
+        self.live = []
+        self.dirty = set()
+        self.index = {}
+        self.type_index = {}
+        self.name_index = {}
+        self.presorted = None
+        self.alarm_log = None
+        self.subscriptions = []
+        self.writes = deque()
+        self.accumulate = set()
+        self.rng = Random()
 
     def add_node(self, node: PaeNode) -> PaeNode:
+        if node.id != "" and node.id in self.index:
+            raise ValueError(f"Duplicate node id '{node.id}'")
+
         self.nodes.append(node)
+        if node.id != "":
+            self.index[node.id] = node
+        self.type_index.setdefault(node.type, []).append(node)
+        self.name_index.setdefault(node.name, []).append(node)
+        node.motor = self
+        self.plan = None
+        self.presorted = None
         return node
 
-    def find_node(self, id: str) -> PaeNode:
-        for node in self.nodes:
-            if node.id == id:
-                return node
-        return None
+    def mark_dirty(self, node: PaeNode) -> None:
+        """Schedule a node for evaluation on the next incremental update."""
+        if self.incremental:
+            self.dirty.add(node)
+
+    def mark_changed(self, node: PaeNode, method: str, *args) -> None:
+        """Called after node.method(*args) changed the state of a node
+        outside update(), motors keeping the state elsewhere replay it."""
+        self.mark_dirty(node)
+
+    def set_write_policy(self, node: PaeNode, policy: PaeWrite) -> None:
+        """Last keeps the last value written in a tick, Accumulate adds every
+        value written to the value of the node."""
+        if policy == PaeWrite.Accumulate:
+            self.accumulate.add(node)
+        else:
+            self.accumulate.discard(node)
+
+    def apply_writes(self) -> None:
+        """Apply the values given to set_value() since the last tick.
+
+        Writers only append to a deque, so no lock is taken. Writes appended
+        while this runs are left for the next tick.
+        """
+        writes = self.writes
+        accumulate = self.accumulate
+        for _ in range(len(writes)):
+            node, value = writes.popleft()
+            if node in accumulate:
+                base = node.value if node.new_value is None else node.new_value
+                node.new_value = base + value
+            else:
+                node.new_value = value
+            self.mark_dirty(node)
+
+    def subscribe(
+        self, node: PaeNode, callback, deadband: float = 0.0, interval: float = 0.0
+    ) -> PaeSubscription:
+        """Call callback(node) after a tick that changed the node.
+
+        A change is a value differing more than deadband from the value last
+        notified, or a change of enabled. Notifications come at most every
+        interval seconds, a change held back is notified when the interval
+        has passed.
+        """
+        sub = PaeSubscription(node, callback, deadband, interval)
+        self.subscriptions.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: PaeSubscription) -> None:
+        self.subscriptions.remove(sub)
+
+    def notify(self) -> None:
+        now = self.time
+        for sub in self.subscriptions:
+            node = sub.node
+            value = node.value
+            enabled = node.enabled
+            if enabled == sub.enabled:
+                if sub.deadband > 0:
+                    if abs(value - sub.value) <= sub.deadband:
+                        continue
+                elif value == sub.value:
+                    continue
+            if now - sub.time < sub.interval:
+                continue
+
+            sub.value = value
+            sub.enabled = enabled
+            sub.time = now
+            try:
+                sub.callback(node)
+            except Exception as e:
+                logging.error(f"Subscriber of node {node.id}: {e}")
 
-    def initiate(self):
-        for node in self.nodes:
-            if type(node.source) is str:
-                node.source = self.find_node(node.source)
+    def find_node(self, id: str) -> PaeNode:
+        return self.index.get(id)
 
-            if type(node.term) is str:
-                node.term = self.find_node(node.term)
+    def find_nodes_by_type(self, type: PaeType) -> list[PaeNode]:
+        return self.type_index.get(type, [])
 
-            if type(node.factor) is str:
-                node.factor = self.find_node(node.factor)
+    def find_nodes_by_name(self, name: str) -> list[PaeNode]:
+        return self.name_index.get(name, [])
 
-            if type(node.divider) is str:
-                node.divider = self.find_node(node.divider)
+    def resolve(self, node: PaeNode, name: str) -> None:
+        ref = getattr(node, name)
+        if type(ref) is not str:
+            return
 
-            if type(node.max_limit) is str:
-                node.max_limit = self.find_node(node.max_limit)
+        found = self.find_node(ref)
+        if found is None:
+            raise ValueError(f"Node '{node.id}': {name} refers to unknown node '{ref}'")
+        setattr(node, name, found)
 
-            if type(node.min_limit) is str:
-                node.min_limit = self.find_node(node.min_limit)
+    def initiate(self):
+        for node in self.nodes:
+            self.resolve(node, "source")
+            for name in node.operands:
+                self.resolve(node, name)
 
-            if type(node.offset) is str:
-                node.offset = self.find_node(node.offset)
+        self.compile()
 
-            if type(node.threshold) is str:
-                node.threshold = self.find_node(node.threshold)
+    def sort(self) -> list[PaeNode]:
+        """Order nodes so every node is evaluated after the nodes it reads.
 
-            if type(node.period) is str:
-                node.period = self.find_node(node.period)
+        Nodes without dependencies between them keep their insertion order.
+        Raises ValueError if the graph contains a cycle. An order already
+        known to be valid, as from a graph cache, can be given in presorted.
+        """
+        if self.presorted is not None and len(self.presorted) == len(self.nodes):
+            return self.presorted
 
-            if type(node.amplitude) is str:
-                node.amplitude = self.find_node(node.amplitude)
+        pending = {}
+        dependents = {node: [] for node in self.nodes}
+        for node in self.nodes:
+            deps = [d for d in node.dependencies() if d in dependents]
+            pending[node] = len(deps)
+            for d in deps:
+                dependents[d].append(node)
+
+        ready = deque(node for node in self.nodes if pending[node] == 0)
+        order = []
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for dep in dependents[node]:
+                pending[dep] -= 1
+                if pending[dep] == 0:
+                    ready.append(dep)
+
+        if len(order) < len(self.nodes):
+            raise ValueError(f"Cycle in node graph: {self.find_cycle(pending)}")
+
+        return order
+
+    def find_cycle(self, pending: dict) -> str:
+        """Describe one cycle among the nodes left unsorted."""
+        node = next(node for node in self.nodes if pending[node] > 0)
+        path = []
+        while node not in path:
+            path.append(node)
+            node = next(d for d in node.dependencies() if pending.get(d, 0) > 0)
+        cycle = path[path.index(node):] + [node]
+        return " <- ".join(n.id or n.get_name() or n.type.name for n in cycle)
+
+    def compile(self) -> None:
+        """Build the flat evaluation plan, one pre-bound update per node in
+        dependency order, so one update() propagates through the whole graph.
+        """
+        for node in self.nodes:
+            node.compile()
+
+        self.order = self.sort()
+        self.plan = [node.update for node in self.order]
+
+        self.rank = {node: i for i, node in enumerate(self.order)}
+        self.dependents = [[] for _ in self.order]
+        for node in self.order:
+            for d in node.dependencies():
+                if d in self.rank:
+                    self.dependents[self.rank[d]].append(self.rank[node])
+        self.live = [
+            i
+            for i, node in enumerate(self.order)
+            if node.live or (node.source is None and not node.idempotent)
+        ]
+        self.dirty = set(self.order)
+
+    def set_time(self, now: float) -> None:
+        """Set the motor time, seconds since the first tick."""
+        if self.start is None:
+            self.start = now
+        self.time = now - self.start
 
     def update(self) -> None:
-        for node in self.nodes:
-            node.update()
+        if self.plan is None:
+            self.initiate()
+
+        self.set_time(self.clock())
+        if self.writes:
+            self.apply_writes()
+
+        if self.incremental:
+            self.update_incremental()
+        else:
+            for update in self.plan:
+                update()
+
+        if self.subscriptions:
+            self.notify()
+
+    def update_incremental(self) -> None:
+        """Evaluate live nodes, nodes marked dirty and everything downstream
+        of a node whose value changed, in dependency order.
+        """
+        queued = set(self.live)
+        for node in self.dirty:
+            i = self.rank.get(node)
+            if i is not None:
+                queued.add(i)
+        self.dirty.clear()
+        queue = list(queued)
+        heapify(queue)
+
+        plan = self.plan
+        order = self.order
+        dependents = self.dependents
+        while queue:
+            i = heappop(queue)
+            node = order[i]
+            before = node.value
+            plan[i]()
+            if node.value != before:
+                for d in dependents[i]:
+                    if d not in queued:
+                        queued.add(d)
+                        heappush(queue, d)
 
     def printout(self) -> None:
         print(self, end="")
@@ -408,6 +1443,371 @@ class PaeMotor(PaeObject):
         return out
 
 
+class PaeRateGroup:
+    """Nodes of a PaeScheduler sharing one interval."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.deadline = 0.0
+        self.plan = []
+        self.misses = 0
+        self.runs = 0
+
+
+class PaeScheduler:
+    """Run the nodes of a motor at the interval each node declares.
+
+    Nodes with interval 0 run at the interval of the scheduler. Deadlines
+    follow a fixed grid on the monotonic clock, so a late cycle does not
+    shift the ones after it. Deadlines passed while a cycle was running are skipped and
+    counted as misses. When several groups are due in the same cycle their
+    nodes are evaluated together in dependency order.
+    """
+
+    def __init__(self, motor: PaeMotor, interval: float = 0.1, clock=time.monotonic) -> None:
+        self.motor = motor
+        self.interval = interval
+        self.clock = clock
+        self.groups = []
+        self.plan = None
+
+    def initiate(self) -> None:
+        motor = self.motor
+        if motor.plan is None:
+            motor.initiate()
+
+        groups = {}
+        for rank, node in enumerate(motor.order):
+            interval = node.interval if node.interval > 0 else self.interval
+            group = groups.get(interval)
+            if group is None:
+                group = groups[interval] = PaeRateGroup(interval)
+            group.plan.append((rank, node.update))
+
+        now = self.clock()
+        motor.set_time(now)
+        for group in groups.values():
+            group.deadline = now
+        self.groups = sorted(groups.values(), key=lambda g: g.interval)
+        self.plan = motor.plan
+
+    def poll(self) -> float:
+        """Run the groups that are due, return seconds to the next deadline."""
+        if self.plan is None or self.plan is not self.motor.plan:
+            self.initiate()
+
+        now = self.clock()
+        self.motor.set_time(now)
+        if self.motor.writes:
+            self.motor.apply_writes()
+
+        due = [group for group in self.groups if now >= group.deadline]
+        if len(due) == 1:
+            for _, update in due[0].plan:
+                update()
+        elif due:
+            for _, update in merge(*[group.plan for group in due], key=lambda p: p[0]):
+                update()
+        if due and self.motor.subscriptions:
+            self.motor.notify()
+
+        end = self.clock()
+        for group in due:
+            late = now - group.deadline
+            group.runs += 1
+            group.deadline += group.interval
+            if group.deadline <= end:
+                missed = int((end - group.deadline) // group.interval) + 1
+                group.misses += missed
+                group.deadline += missed * group.interval
+                logging.warning(
+                    "Interval %.3f s: missed %d deadline(s), started %.3f s late, ran %.3f s",
+                    group.interval,
+                    missed,
+                    late,
+                    end - now,
+                )
+
+        return max(min(group.deadline for group in self.groups) - end, 0.0)
+
+    def misses(self) -> dict[float, int]:
+        """Deadline misses per interval."""
+        return {group.interval: group.misses for group in self.groups}
+
+    def run(self, duration: float = None) -> None:
+        """Poll until duration seconds have passed, forever if None."""
+        end = None if duration is None else self.clock() + duration
+        while end is None or self.clock() < end:
+            time.sleep(self.poll())
+
+
+def integrate_kernel(cur, sv, last, dt, f, hi, lo):
+    out = np.where(np.isnan(dt), cur, cur + f * sv * dt)
+    return np.where(hi > lo, np.minimum(np.maximum(out, lo), hi), out)
+
+
+def rate_limit_kernel(cur, sv, last, dt, up, down):
+    step = sv - cur
+    step = np.where((up > 0) & (step > up * dt), up * dt, step)
+    step = np.where((down > 0) & (step < -down * dt), -down * dt, step)
+    return np.where(np.isnan(dt), sv, cur + step)
+
+
+# Vectorized kernels used by PaeArrayMotor, called with the current values,
+# the source values, the last values and the operand values of a node group.
+# Kernels of array_timed_types also get the seconds since the last
+# evaluation of each node after the last values, NaN on the first one.
+array_kernels = {
+    PaeType.Normal: ((), lambda cur, sv, last: sv),
+    PaeType.Min: ((), lambda cur, sv, last: np.minimum(cur, sv)),
+    PaeType.Max: ((), lambda cur, sv, last: np.maximum(cur, sv)),
+    PaeType.Counter: ((), lambda cur, sv, last: cur + ((sv > 0.5) & (last < 0.5))),
+    PaeType.Limit: (
+        ("max_limit", "min_limit"),
+        lambda cur, sv, last, mx, mn: np.where(sv > mx, mx, np.where(sv < mn, mn, sv)),
+    ),
+    PaeType.Multiply: (("factor",), lambda cur, sv, last, f: sv * f),
+    PaeType.Division: (("divider",), lambda cur, sv, last, d: sv / d),
+    PaeType.Multiply_Add: (("factor", "term"), lambda cur, sv, last, f, t: sv * f + t),
+    PaeType.Subtract: (("term",), lambda cur, sv, last, t: sv - t),
+    PaeType.Addition: (("term",), lambda cur, sv, last, t: sv + t),
+    PaeType.Absolute: ((), lambda cur, sv, last: np.abs(sv)),
+    PaeType.Above: (("threshold",), lambda cur, sv, last, t: np.where(sv > t, 1.0, 0.0)),
+    PaeType.Below: (("threshold",), lambda cur, sv, last, t: np.where(sv < t, 1.0, 0.0)),
+    PaeType.Integrate: (("factor", "max_limit", "min_limit"), integrate_kernel),
+    PaeType.Derivate: (
+        ("factor",),
+        lambda cur, sv, last, dt, f: np.where(dt > 0, f * (sv - last) / dt, cur),
+    ),
+    PaeType.RateLimit: (("max_limit", "min_limit"), rate_limit_kernel),
+}
+
+# Kernel types that keep the source value in last
+array_last_types = {PaeType.Counter, PaeType.Derivate}
+
+# Kernel types using the time since the last evaluation
+array_timed_types = {PaeType.Integrate, PaeType.Derivate, PaeType.RateLimit}
+
+
+
+def _view_get_value(node: PaeNode) -> float:
+    return node.motor.values[node._index]
+
+
+def _view_set_value(node: PaeNode, value: float) -> None:
+    node.motor.values[node._index] = value
+
+
+def _view_get_last(node: PaeNode) -> float:
+    return node.motor.last[node._index]
+
+
+def _view_set_last(node: PaeNode, value: float) -> None:
+    node.motor.last[node._index] = value
+
+
+def _view_get_stamp(node: PaeNode) -> float:
+    stamp = node.motor.stamps[node._index]
+    return None if stamp != stamp else float(stamp)
+
+
+def _view_set_stamp(node: PaeNode, stamp: float) -> None:
+    node.motor.stamps[node._index] = np.nan if stamp is None else stamp
+
+
+def _view_get_enabled(node: PaeNode) -> bool:
+    return bool(node.motor.enabled_mask[node._index])
+
+
+def _view_set_enabled(node: PaeNode, en: bool) -> None:
+    node.motor.enabled_mask[node._index] = en
+
+
+array_views = {}
+
+
+def array_view(cls: type) -> type:
+    """Subclass of a node class reading value, last, stamp and enabled from
+    the arrays of a PaeArrayMotor."""
+    view = array_views.get(cls)
+    if view is None:
+        view = type(
+            f"{cls.__name__}View",
+            (cls,),
+            {
+                "__slots__": (),
+                "value": property(_view_get_value, _view_set_value),
+                "last": property(_view_get_last, _view_set_last),
+                "stamp": property(_view_get_stamp, _view_set_stamp),
+                "enabled": property(_view_get_enabled, _view_set_enabled),
+            },
+        )
+        array_views[cls] = view
+        array_views[view] = view
+    return view
+
+
+class PaeArrayMotor(PaeMotor):
+    """PaeMotor keeping node state in NumPy arrays.
+
+    Nodes are grouped by type within each dependency level and the types in
+    array_kernels are evaluated with one vectorized operation per group.
+    Other types, and groups smaller than batch_size where a vectorized call
+    costs more than a few scalar ones, are updated one by one as usual.
+    After initiate() every batched node is a view on the arrays, so value,
+    last, stamp and enabled are read and written through the motor.
+    """
+
+    batch_size = 16
+
+    def __init__(self, clock=time.monotonic) -> None:
+        if np is None:
+            raise ImportError("PaeArrayMotor requires numpy")
+        super().__init__(incremental=False, clock=clock)
+        self.values = np.zeros(0)
+        self.last = np.zeros(0)
+        self.stamps = np.zeros(0)
+        self.enabled_mask = np.ones(0, dtype=bool)
+        self.viewed = set()
+
+    def mark_dirty(self, node: PaeNode) -> None:
+        self.dirty.add(node)
+
+    def apply_writes(self) -> None:
+        """Copy values given to set_value() into the value array."""
+        super().apply_writes()
+        if not self.dirty:
+            return
+        for node in self.dirty:
+            if node.new_value is not None and node in self.viewed:
+                self.values[self.rank[node]] = node.new_value
+                node.new_value = None
+        self.dirty.clear()
+
+    def compile(self) -> None:
+        for node in self.nodes:
+            node.compile()
+            if array_views.get(type(node)) is type(node):
+                cls = type(node).__bases__[0]
+                state = {
+                    name: getattr(node, name)
+                    for name in ("value", "last", "stamp", "enabled")
+                    if isinstance(getattr(cls, name), MemberDescriptorType)
+                }
+                node.__class__ = cls
+                for name, v in state.items():
+                    setattr(node, name, v)
+        self.viewed = set()
+
+        self.order = self.sort()
+        self.rank = {node: i for i, node in enumerate(self.order)}
+        n = len(self.order)
+
+        const_values = []
+        operands = {}
+        for node in self.order:
+            names = array_kernels.get(node.type, ((), None))[0]
+            for name in names:
+                op = getattr(node, f"_{name}")
+                if isinstance(op, PaeConstant):
+                    operands[node, name] = n + len(const_values)
+                    const_values.append(op.value)
+                else:
+                    operands[node, name] = self.rank.get(op)
+
+        values = np.zeros(n + len(const_values))
+        values[:n] = [node.value for node in self.order]
+        values[n:] = const_values
+        last = np.array([node.last for node in self.order], dtype=float)
+        stamps = np.array(
+            [np.nan if node.stamp is None else node.stamp for node in self.order], dtype=float
+        )
+        enabled = np.array([node.enabled for node in self.order], dtype=bool)
+        self.values, self.last, self.stamps, self.enabled_mask = values, last, stamps, enabled
+
+        levels = []
+        for i, node in enumerate(self.order):
+            deps = [self.rank[d] for d in node.dependencies() if d in self.rank]
+            levels.append(max((levels[d] + 1 for d in deps), default=0))
+
+        groups = {}
+        for i, node in enumerate(self.order):
+            batched = node.type in array_kernels and all(
+                d in self.rank for d in node.dependencies()
+            )
+            key = (levels[i], node.type if batched else None)
+            groups.setdefault(key, []).append(i)
+        for key, members in list(groups.items()):
+            if key[1] is not None and len(members) < self.batch_size:
+                del groups[key]
+                groups.setdefault((key[0], None), []).extend(members)
+
+        for (level, kind), members in groups.items():
+            if kind is not None:
+                for i in members:
+                    node = self.order[i]
+                    node.__class__ = array_view(type(node))
+                    node._index = i
+                    self.viewed.add(node)
+
+        self.plan = [self.apply_writes]
+        for (level, kind), members in sorted(groups.items(), key=lambda g: g[0][0]):
+            if kind is None:
+                self.plan.extend(self.order[i].update for i in sorted(members))
+                continue
+
+            names, kernel = array_kernels[kind]
+            idx = np.array(members)
+            src = np.array(
+                [
+                    i if self.order[i].source is None else self.rank[self.order[i].source]
+                    for i in members
+                ]
+            )
+            ops = [np.array([operands[self.order[i], name] for i in members]) for name in names]
+            inputs = {j for j in src.tolist() + [j for o in ops for j in o.tolist()] if j < n}
+            inputs = [self.order[j] for j in sorted(inputs) if self.order[j] not in self.viewed]
+            if inputs:
+                self.plan.append(self.gather(inputs))
+            self.plan.append(
+                self.batch(kernel, idx, src, ops, kind in array_last_types, kind in array_timed_types)
+            )
+
+        self.dirty = set(self.order)
+
+    def gather(self, nodes: list):
+        """Step copying the values of nodes updated one by one into the value
+        array, for the batched nodes reading them."""
+        values = self.values
+        idx = np.array([self.rank[node] for node in nodes])
+
+        def step() -> None:
+            values[idx] = [node.value for node in nodes]
+
+        return step
+
+    def batch(self, kernel, idx, src, ops, keep_last: bool, timed: bool):
+        """Evaluation step for one group of nodes of the same type."""
+        values, last, stamps, enabled = self.values, self.last, self.stamps, self.enabled_mask
+
+        def step() -> None:
+            sv = values[src]
+            cur = values[idx]
+            args = [values[o] for o in ops]
+            if timed:
+                args.insert(0, self.time - stamps[idx])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out = kernel(cur, sv, last[idx], *args)
+            en = enabled[idx]
+            values[idx] = np.where(en, out, cur)
+            if keep_last:
+                last[idx] = np.where(en, sv, last[idx])
+            if timed:
+                stamps[idx] = np.where(en, self.time, stamps[idx])
+
+        return step
+
+
 def main() -> None:
     n_sin = PaeNode(type=PaeType.Sine, id="sin")
     n_sqr = PaeNode(type=PaeType.Square, id="square")
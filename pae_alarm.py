@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# --------------------------------------------------------------------------
+#
+# Alarm log for the Python automation engine
+#
+# File:    pae_alarm.py
+# Author:  Peter Malmberg <peter.malmberg@gmail.com>
+# Date:
+# Version: 0.1
+# Python:  >=3.9
+# License: MIT
+#
+# ---------------------------------------------------------------------------
+#
+# Alarm nodes report raised and cleared alarms to the log of their motor.
+# The latest events are kept in a fixed size ring, all of them can also be
+# appended to a text file, one tab separated line per event:
+#
+#   time  id  RAISED|CLEARED  value
+#
+
+from __future__ import annotations
+import logging
+import os
+from array import array
+from pae import PaeMotor, PaeNode, PaeType
+
+alarm_types = (PaeType.Alarm_above, PaeType.Alarm_below, PaeType.Alarm_between)
+
+
+class PaeAlarmLog:
+    """Events of the alarm nodes of a motor.
+
+    Subscribers are called as subscriber(node, raised, value, time) on every
+    transition. Events are stamped with the motor time, so a simulation
+    gives the same log every run, unless another clock is given. Evaluating
+    alarms allocates nothing unless one changes state, the ring is allocated
+    up front.
+    """
+
+    def __init__(self, motor: PaeMotor, path: str = None, size: int = 1000, clock=None) -> None:
+        self.motor = motor
+        self.path = path
+        self.size = size
+        self.clock = clock
+        self.times = array("d", [0.0]) * size
+        self.values = array("d", [0.0]) * size
+        self.states = bytearray(size)
+        self.nodes = [None] * size
+        self.head = 0
+        self.count = 0
+        self.subscribers = []
+        self.file = open(path, "a") if path is not None else None
+        motor.alarm_log = self
+
+    def subscribe(self, subscriber) -> None:
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber) -> None:
+        self.subscribers.remove(subscriber)
+
+    def event(self, node: PaeNode, value: float) -> None:
+        now = self.motor.time if self.clock is None else self.clock()
+        raised = node.value >= 0.5
+        i = self.head
+        self.times[i] = now
+        self.values[i] = value
+        self.states[i] = raised
+        self.nodes[i] = node
+        self.head = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+        if self.file is not None:
+            try:
+                self.file.write(f"{now:.3f}\t{node.id}\t{'RAISED' if raised else 'CLEARED'}\t{value}\n")
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except OSError as e:
+                logging.error(f"Alarm log {self.path}: {e}")
+
+        for subscriber in self.subscribers:
+            try:
+                subscriber(node, raised, value, now)
+            except Exception as e:
+                logging.error(f"Alarm subscriber {subscriber}: {e}")
+
+    def events(self) -> list[tuple]:
+        """Events in the ring as (time, node, raised, value), oldest first."""
+        start = (self.head - self.count) % self.size
+        out = []
+        for n in range(self.count):
+            i = (start + n) % self.size
+            out.append((self.times[i], self.nodes[i], bool(self.states[i]), self.values[i]))
+        return out
+
+    def active(self) -> list[PaeNode]:
+        """Alarm nodes currently raised."""
+        return [
+            node
+            for kind in alarm_types
+            for node in self.motor.find_nodes_by_type(kind)
+            if node.value >= 0.5
+        ]
+
+    def close(self) -> None:
+        if self.motor.alarm_log is self:
+            self.motor.alarm_log = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# --------------------------------------------------------------------------
+#
+# Headless asyncio runtime for the Python automation engine
+#
+# File:    pae_async.py
+# Author:  Peter Malmberg <peter.malmberg@gmail.com>
+# Date:
+# Version: 0.1
+# Python:  >=3.9
+# License: MIT
+#
+# ---------------------------------------------------------------------------
+
+from __future__ import annotations
+import argparse
+import asyncio
+import inspect
+import logging
+import time
+from pae import PaeMotor, PaeNode, PaeScheduler, PaeType
+
+
+class PaeAsyncSource:
+    """Periodic reader feeding a node.
+
+    read is either a coroutine function or a plain blocking function, the
+    latter is run in a worker thread so it never blocks the engine.
+    """
+
+    def __init__(self, node: PaeNode, read, interval: float = 1.0) -> None:
+        self.node = node
+        self.read = read
+        self.interval = interval
+        self.errors = 0
+
+    async def value(self) -> float:
+        if inspect.iscoroutinefunction(self.read):
+            return await self.read()
+        return await asyncio.to_thread(self.read)
+
+    async def run(self, clock) -> None:
+        deadline = clock()
+        while True:
+            try:
+                value = await self.value()
+                if value is not None:
+                    self.node.set_value(value)
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Source for node {self.node.id}: {e}")
+
+            deadline += self.interval
+            now = clock()
+            if deadline < now:
+                deadline = now
+            await asyncio.sleep(deadline - now)
+
+
+class PaeRunner:
+    """Drive a PaeMotor from asyncio.
+
+    The motor is ticked by a PaeScheduler on the monotonic clock, sources are
+    awaited in their own tasks and observers are called after every cycle
+    that evaluated nodes. Observers may be plain functions or coroutine
+    functions taking the motor, a Qt frontend can attach one that emits a
+    signal to its own thread.
+    """
+
+    def __init__(self, motor: PaeMotor, interval: float = 1.0, clock=time.monotonic) -> None:
+        self.motor = motor
+        self.clock = clock
+        self.scheduler = PaeScheduler(motor, interval, clock)
+        self.sources = []
+        self.observers = []
+        self.running = False
+        self.tasks = []
+
+    def add_source(self, node: PaeNode, read, interval: float = 1.0) -> PaeAsyncSource:
+        source = PaeAsyncSource(node, read, interval)
+        self.sources.append(source)
+        if self.running:
+            self.tasks.append(asyncio.create_task(source.run(self.clock)))
+        return source
+
+    def add_observer(self, observer) -> None:
+        self.observers.append(observer)
+
+    def remove_observer(self, observer) -> None:
+        self.observers.remove(observer)
+
+    async def notify(self) -> None:
+        for observer in self.observers:
+            try:
+                if inspect.iscoroutinefunction(observer):
+                    await observer(self.motor)
+                else:
+                    observer(self.motor)
+            except Exception as e:
+                logging.error(f"Observer {observer}: {e}")
+
+    async def run(self, duration: float = None) -> None:
+        """Run until stop() is called or duration seconds have passed."""
+        self.running = True
+        self.tasks = [asyncio.create_task(s.run(self.clock)) for s in self.sources]
+        end = None if duration is None else self.clock() + duration
+        try:
+            while self.running and (end is None or self.clock() < end):
+                runs = sum(group.runs for group in self.scheduler.groups)
+                delay = self.scheduler.poll()
+                if sum(group.runs for group in self.scheduler.groups) != runs:
+                    await self.notify()
+                await asyncio.sleep(delay)
+        finally:
+            self.running = False
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.tasks = []
+
+    def stop(self) -> None:
+        self.running = False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a pae graph without GUI")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to run")
+    parser.add_argument("--interval", type=float, default=1.0, help="Tick interval in seconds")
+    parser.add_argument("--record", type=str, default=None, help="Record node values to directory")
+    parser.add_argument("--debug", action="store_true", default=False, help="Print debug messages")
+    args = parser.parse_args()
+
+    logging_format = "[%(levelname)s] %(lineno)-4d %(funcName)-14s : %(message)s"
+    logging.basicConfig(format=logging_format, level=logging.DEBUG if args.debug else logging.INFO)
+
+    from onewire import ds18b20
+
+    motor = PaeMotor()
+    runner = PaeRunner(motor, args.interval)
+    for i, device in enumerate(ds18b20.list_devices()):
+        node = motor.add_node(PaeNode(name=device.device_id, type=PaeType.Normal, id=f"temp{i}"))
+        runner.add_source(node, device.read_temperature_async, args.interval)
+
+    if not motor.nodes:
+        logging.info("No 1-Wire sensors found, running demo graph")
+        motor.add_node(PaeNode(name="Sine", type=PaeType.Sine, id="sin", period=20.0))
+        motor.add_node(PaeNode(name="Max", type=PaeType.Max, id="max", source="sin"))
+
+    runner.add_observer(lambda motor: motor.printout())
+    recorder = None
+    if args.record is not None:
+        from pae_recorder import PaeRecorder
+
+        recorder = PaeRecorder(motor, args.record)
+        runner.add_observer(lambda motor: recorder.record())
+    try:
+        asyncio.run(runner.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+
+if __name__ == "__main__":
+    main()
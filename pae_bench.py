@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# --------------------------------------------------------------------------
+#
+# Benchmarks for the Python automation engine
+#
+# File:    pae_bench.py
+# Author:  Peter Malmberg <peter.malmberg@gmail.com>
+# Date:
+# Version: 0.1
+# Python:  >=3.9
+# License: MIT
+#
+# ---------------------------------------------------------------------------
+
+from __future__ import annotations
+import argparse
+import gc
+import tracemalloc
+from pae import PaeNode, PaeType
+
+
+class DictNode:
+    """Node with the per-instance __dict__ layout PaeNode used before slots,
+    kept as reference for the memory benchmark."""
+
+    def __init__(self, id: str = "", type: PaeType = PaeType.Normal) -> None:
+        self.tick = 0
+        self.enabled = True
+        self.name = ""
+        self.desc = ""
+        self.unit = ""
+        self.src_id = ""
+        self.id = id
+        self.value = 0.0
+        self.last = 0.0
+        self.type = type
+        self.source = None
+        self.invalid = False
+        self.no_data = False
+        self.out_of_range = False
+        self.max_limit = 0.0
+        self.min_limit = 0.0
+        self.term = 0.0
+        self.offset = 0.0
+        self.factor = 1.0
+        self.threshold = 0.0
+        self.period = 1.0
+        self.amplitude = 1.0
+        self.average = 1
+        self.divider = 1.0
+        self._trigger = False
+        self.new_value = None
+
+
+bench_types = (PaeType.Normal, PaeType.Addition, PaeType.Multiply, PaeType.Above)
+
+
+def measure(cls, n: int) -> int:
+    """Bytes allocated for n nodes of a mix of common types."""
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    nodes = [cls(id=f"n{i}", type=bench_types[i % len(bench_types)]) for i in range(n)]
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del nodes
+    return size
+
+
+def memory_benchmark(sizes: list[int]) -> None:
+    print(f"{'Nodes':>10} {'dict [MB]':>10} {'slots [MB]':>11} {'B/node':>7} {'B/node':>7} {'Saved':>6}")
+    for n in sizes:
+        old = measure(DictNode, n)
+        new = measure(PaeNode, n)
+        print(
+            f"{n:10} {old / 1e6:10.1f} {new / 1e6:11.1f} {old / n:7.0f} {new / n:7.0f} {1 - new / old:6.0%}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pae benchmarks")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 1_000_000],
+        help="Number of nodes to allocate",
+    )
+    args = parser.parse_args()
+    memory_benchmark(args.sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# --------------------------------------------------------------------------
+#
+# Checkpoints of the runtime state of a PaeMotor
+#
+# File:    pae_checkpoint.py
+# Author:  Peter Malmberg <peter.malmberg@gmail.com>
+# Date:
+# Version: 0.1
+# Python:  >=3.9
+# License: MIT
+#
+# ---------------------------------------------------------------------------
+#
+# A checkpoint is a base file with the state of every node plus a journal
+# of the nodes that changed since. The base file is replaced atomically,
+# journal entries are appended with a CRC so a torn last entry is dropped
+# on restore. Nodes are identified by id, nodes without id are not saved.
+#
+# Record:  id length (u16) | id | value count (u16) | values (f64)
+# Base:    magic | version (u16) | record count (u32) | records | crc32
+# Journal: entry length (u32) | crc32 | record count (u32) | records
+#
+
+from __future__ import annotations
+import logging
+import os
+import struct
+import time
+import zlib
+from pae import PaeMotor
+
+checkpoint_magic = b"PAES"
+checkpoint_version = 1
+journal_suffix = ".journal"
+
+
+def pack_records(states: dict) -> bytes:
+    out = []
+    for id, state in states.items():
+        key = id.encode()
+        out.append(struct.pack(f"<H{len(key)}sH{len(state)}d", len(key), key, len(state), *state))
+    return b"".join(out)
+
+
+def unpack_records(data: bytes, count: int, states: dict) -> None:
+    pos = 0
+    for _ in range(count):
+        (klen,) = struct.unpack_from("<H", data, pos)
+        pos += 2
+        id = data[pos:pos + klen].decode()
+        pos += klen
+        (n,) = struct.unpack_from("<H", data, pos)
+        pos += 2
+        states[id] = struct.unpack_from(f"<{n}d", data, pos)
+        pos += 8 * n
+
+
+class PaeCheckpoint:
+    """Save and restore the node state of a motor.
+
+    save() appends the nodes whose state changed since the last save to the
+    journal and rewrites the base file once the journal is larger than it.
+    poll() saves when interval seconds have passed, call it after each tick.
+    """
+
+    def __init__(self, motor: PaeMotor, path: str, interval: float = 60.0, clock=time.monotonic) -> None:
+        self.motor = motor
+        self.path = path
+        self.journal_path = path + journal_suffix
+        self.interval = interval
+        self.clock = clock
+        self.saved = {}
+        self.base_size = 0
+        self.journal_size = 0
+        self.deadline = None
+
+    def states(self) -> dict:
+        return {node.id: node.get_state() for node in self.motor.nodes if node.id != ""}
+
+    def write_base(self, states: dict) -> None:
+        body = struct.pack("<4sHI", checkpoint_magic, checkpoint_version, len(states))
+        body += pack_records(states)
+        body += struct.pack("<I", zlib.crc32(body))
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        # The journal only holds changes relative to the old base
+        with open(self.journal_path, "wb") as f:
+            os.fsync(f.fileno())
+        self.base_size = len(body)
+        self.journal_size = 0
+
+    def append_journal(self, changed: dict) -> None:
+        payload = struct.pack("<I", len(changed)) + pack_records(changed)
+        entry = struct.pack("<II", len(payload), zlib.crc32(payload)) + payload
+        with open(self.journal_path, "ab") as f:
+            f.write(entry)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_size += len(entry)
+
+    def save(self, full: bool = False) -> int:
+        """Write a checkpoint, return the number of nodes written."""
+        states = self.states()
+        if full or not os.path.exists(self.path):
+            self.write_base(states)
+            self.saved = states
+            return len(states)
+
+        changed = {id: s for id, s in states.items() if self.saved.get(id) != s}
+        if not changed:
+            return 0
+
+        self.append_journal(changed)
+        self.saved.update(changed)
+        if self.journal_size > self.base_size:
+            self.write_base(self.saved)
+        return len(changed)
+
+    def poll(self) -> None:
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now + self.interval
+        elif now >= self.deadline:
+            self.deadline = now + self.interval
+            try:
+                self.save()
+            except OSError as e:
+                logging.error(f"Checkpoint {self.path}: {e}")
+
+    def read(self) -> dict:
+        """States in the checkpoint, empty if there is none."""
+        states = {}
+        try:
+            with open(self.path, "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return states
+
+        if len(body) < 14 or zlib.crc32(body[:-4]) != struct.unpack_from("<I", body, len(body) - 4)[0]:
+            logging.error(f"Checkpoint {self.path} is corrupt, not restored")
+            return states
+        magic, version, count = struct.unpack_from("<4sHI", body)
+        if magic != checkpoint_magic or version != checkpoint_version:
+            logging.error(f"Checkpoint {self.path} has unknown format, not restored")
+            return states
+        unpack_records(body[10:-4], count, states)
+        self.base_size = len(body)
+
+        try:
+            with open(self.journal_path, "rb") as f:
+                journal = f.read()
+        except FileNotFoundError:
+            journal = b""
+
+        pos = 0
+        while pos + 8 <= len(journal):
+            length, crc = struct.unpack_from("<II", journal, pos)
+            payload = journal[pos + 8:pos + 8 + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                logging.warning(f"Checkpoint journal {self.journal_path}: dropped torn entry")
+                break
+            (count,) = struct.unpack_from("<I", payload)
+            unpack_records(payload[4:], count, states)
+            pos += 8 + length
+        self.journal_size = pos
+        return states
+
+    def restore(self) -> int:
+        """Restore node states from the checkpoint, return the number of
+        nodes restored. Nodes missing from the motor are skipped."""
+        restored = {}
+        for id, state in self.read().items():
+            node = self.motor.find_node(id)
+            if node is None:
+                continue
+            try:
+                node.set_state(state)
+                restored[id] = state
+            except (IndexError, ValueError) as e:
+                logging.warning(f"Checkpoint state of node {id} not restored: {e}")
+        # States of nodes no longer in the motor are dropped on the next base
+        self.saved = restored
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) != self.journal_size:
+            # Entries appended after a torn one would never be read
+            self.write_base(restored)
+        return len(restored)
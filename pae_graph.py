@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# --------------------------------------------------------------------------
+#
+# Graph files for the Python automation engine
+#
+# File:    pae_graph.py
+# Author:  Peter Malmberg <peter.malmberg@gmail.com>
+# Date:
+# Version: 0.1
+# Python:  >=3.9
+# License: MIT
+#
+# ---------------------------------------------------------------------------
+#
+# A graph is a list of nodes with the PaeNode constructor parameters, given
+# as JSON or TOML. Types are PaeType names, references to other nodes are
+# node ids and "value" sets the initial value of a node.
+#
+#   {"nodes": [
+#       {"id": "setp", "name": "Setpoint", "value": 30.0},
+#       {"id": "llim", "type": "Subtract", "source": "setp", "term": 3.0}
+#   ]}
+#
+# Loading writes a cache next to the file with the nodes already sorted and
+# the references resolved, it is used as long as the file is unchanged. The
+# cache holds JSON data only, with types given by name as in the graph. It
+# saves parsing, validation, reference lookup and sorting, the nodes are
+# still created and compiled, so loading is only about a quarter faster.
+#
+
+from __future__ import annotations
+import argparse
+import gc
+import hashlib
+import inspect
+import json
+import logging
+import os
+import time
+from pae import PaeFType, PaeMotor, PaeNode, PaeType, node_classes
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+graph_version = 1
+cache_version = 2
+cache_magic = b"PAEG"
+cache_suffix = ".cache"
+
+node_defaults = {
+    name: p.default
+    for name, p in inspect.signature(PaeNode.__init__).parameters.items()
+    if name != "self"
+}
+operand_fields = {name for cls in node_classes.values() for name in cls.operands}
+
+
+def is_number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def validate_field(name: str, v) -> str:
+    """Problem with a node field, empty if it is valid."""
+    if name == "type":
+        return "" if isinstance(v, str) and v in PaeType.__members__ else "unknown node type"
+    if name == "ftype":
+        return "" if isinstance(v, str) and v in PaeFType.__members__ else "unknown filter type"
+    if name == "source":
+        return "" if isinstance(v, str) else "expected node id"
+    if name == "taps":
+        ok = v is None or (isinstance(v, list) and all(is_number(x) for x in v))
+        return "" if ok else "expected list of numbers"
+    if name == "value" or name in operand_fields:
+        return "" if is_number(v) or isinstance(v, str) and name != "value" else "expected number"
+
+    default = node_defaults[name]
+    if isinstance(default, bool):
+        return "" if isinstance(v, bool) else "expected boolean"
+    if isinstance(default, int):
+        return "" if isinstance(v, int) and not isinstance(v, bool) else "expected integer"
+    if isinstance(default, float):
+        return "" if is_number(v) else "expected number"
+    return "" if isinstance(v, str) else "expected string"
+
+
+def validate_graph(data) -> None:
+    """Check a parsed graph, raises ValueError listing every problem."""
+    errors = []
+    if not isinstance(data, dict) or not isinstance(data.get("nodes"), list):
+        raise ValueError("graph: expected an object with a list of nodes")
+
+    version = data.get("version", graph_version)
+    if version != graph_version:
+        errors.append(f"version: unsupported version {version}")
+
+    ids = set()
+    for i, node in enumerate(data["nodes"]):
+        if not isinstance(node, dict):
+            errors.append(f"nodes[{i}]: expected an object")
+            continue
+        for name, v in node.items():
+            if name not in node_defaults and name != "value":
+                errors.append(f"nodes[{i}].{name}: unknown field")
+                continue
+            problem = validate_field(name, v)
+            if problem:
+                errors.append(f"nodes[{i}].{name}: {problem}")
+
+        id = node.get("id", "")
+        if id != "" and id in ids:
+            errors.append(f"nodes[{i}].id: duplicate id '{id}'")
+        ids.add(id)
+
+    for i, node in enumerate(data["nodes"]):
+        if not isinstance(node, dict):
+            continue
+        for name, v in node.items():
+            if (name == "source" or name in operand_fields) and isinstance(v, str) and v not in ids:
+                errors.append(f"nodes[{i}].{name}: unknown node '{v}'")
+
+    if errors:
+        raise ValueError("Invalid graph:\n  " + "\n  ".join(errors))
+
+
+def parse_graph(raw: bytes, path: str):
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise ImportError("TOML graphs require Python 3.11 or newer")
+        return tomllib.loads(raw.decode())
+    return json.loads(raw)
+
+
+def node_kwargs(spec: dict) -> dict:
+    kwargs = {k: v for k, v in spec.items() if k != "value"}
+    if "type" in kwargs:
+        kwargs["type"] = PaeType[kwargs["type"]]
+    if "ftype" in kwargs:
+        kwargs["ftype"] = PaeFType[kwargs["ftype"]]
+    return kwargs
+
+
+def read_cache(path: str, digest: bytes) -> list:
+    """Compiled nodes from a cache file, None if missing, out of date or
+    malformed."""
+    try:
+        with open(path, "rb") as f:
+            if f.read(4) != cache_magic or f.read(32) != digest:
+                return None
+            data = json.loads(f.read())
+        if data["version"] != cache_version:
+            return None
+        return [
+            (node_kwargs(kwargs), [(str(name), int(i)) for name, i in refs], value)
+            for kwargs, refs, value in data["specs"]
+        ]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def write_cache(path: str, digest: bytes, specs: list) -> None:
+    specs = [
+        (dict(kwargs, type=kwargs["type"].name), refs, value) for kwargs, refs, value in specs
+    ]
+    for kwargs, _, _ in specs:
+        if "ftype" in kwargs:
+            kwargs["ftype"] = kwargs["ftype"].name
+
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(cache_magic)
+            f.write(digest)
+            f.write(json.dumps({"version": cache_version, "specs": specs}).encode())
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.warning(f"Could not write graph cache {path}: {e}")
+
+
+def compiled_specs(motor: PaeMotor, values: dict) -> list:
+    """Nodes of an initiated motor in evaluation order, as (kwargs, refs,
+    value) with refs giving the field and order index of referenced nodes."""
+    rank = motor.rank
+    specs = []
+    for node in motor.order:
+        kwargs = {"id": node.id, "name": node.name, "desc": node.desc, "type": node.type}
+        refs = []
+        if node.interval:
+            kwargs["interval"] = node.interval
+        fields = dict(node.parameters())
+        if node.source is not None:
+            fields["source"] = node.source
+        for name, v in fields.items():
+            if isinstance(v, PaeNode):
+                refs.append((name, rank[v]))
+            else:
+                kwargs[name] = v
+        specs.append((kwargs, refs, values.get(node)))
+    return specs
+
+
+def build_compiled(motor: PaeMotor, specs: list) -> None:
+    presorted = len(motor.nodes) == 0
+    nodes = []
+    for kwargs, refs, value in specs:
+        if refs:
+            kwargs = dict(kwargs)
+            for name, i in refs:
+                kwargs[name] = nodes[i]
+        node = PaeNode(**kwargs)
+        if value is not None:
+            node.value = value
+        nodes.append(motor.add_node(node))
+
+    if presorted:
+        # References are resolved already, only nodes of a motor that was
+        # not empty could still refer to others by id
+        motor.presorted = nodes
+        motor.compile()
+    else:
+        motor.initiate()
+
+
+def load_graph(path: str, motor: PaeMotor = None, cache: bool = True) -> PaeMotor:
+    """Load a JSON or TOML graph into motor, a new PaeMotor by default."""
+    if motor is None:
+        motor = PaeMotor()
+
+    # Nodes are never garbage, collecting while creating them only costs time
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return load(path, motor, cache)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def load(path: str, motor: PaeMotor, cache: bool) -> PaeMotor:
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).digest()
+    cache_path = path + cache_suffix
+
+    specs = read_cache(cache_path, digest) if cache else None
+    if specs is not None:
+        build_compiled(motor, specs)
+        return motor
+
+    data = parse_graph(raw, path)
+    validate_graph(data)
+    values = {}
+    for spec in data["nodes"]:
+        node = motor.add_node(PaeNode(**node_kwargs(spec)))
+        if "value" in spec:
+            node.value = float(spec["value"])
+            values[node] = node.value
+    motor.initiate()
+
+    if cache:
+        write_cache(cache_path, digest, compiled_specs(motor, values))
+    return motor
+
+
+def graph_data(motor: PaeMotor) -> dict:
+    """Graph of a motor in file form, parameters equal to the default are left
+    out and Normal nodes without source keep their current value."""
+    nodes = []
+    for node in motor.nodes:
+        spec = {"id": node.id}
+        if node.name:
+            spec["name"] = node.name
+        if node.desc:
+            spec["desc"] = node.desc
+        spec["type"] = node.type.name
+        if node.source is not None:
+            spec["source"] = node.source if isinstance(node.source, str) else node.source.id
+        if node.interval:
+            spec["interval"] = node.interval
+
+        for name, v in node.parameters().items():
+            if isinstance(v, PaeNode):
+                if v.id == "":
+                    raise ValueError(f"Node '{node.id}': {name} refers to a node without id")
+                spec[name] = v.id
+            elif isinstance(v, (PaeType, PaeFType)):
+                if v != node_defaults[name]:
+                    spec[name] = v.name
+            elif v != node_defaults[name]:
+                spec[name] = v
+
+        if node.type == PaeType.Normal and node.source is None and node.value != 0:
+            spec["value"] = float(node.value)
+        nodes.append(spec)
+    return {"version": graph_version, "nodes": nodes}
+
+
+def toml_value(v) -> str:
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    if isinstance(v, list):
+        return "[" + ", ".join(toml_value(x) for x in v) + "]"
+    if isinstance(v, str):
+        return json.dumps(v)
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def save_graph(motor: PaeMotor, path: str) -> None:
+    """Save the graph of a motor as TOML if path ends with .toml, else JSON."""
+    data = graph_data(motor)
+    if path.endswith(".toml"):
+        out = f"version = {data['version']}\n"
+        for spec in data["nodes"]:
+            out += "\n[[nodes]]\n"
+            out += "".join(f"{k} = {toml_value(v)}\n" for k, v in spec.items())
+    else:
+        out = json.dumps(data, indent=2) + "\n"
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(out)
+    os.replace(tmp, path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load and check a pae graph")
+    parser.add_argument("graph", help="JSON or TOML graph file")
+    parser.add_argument("--no-cache", action="store_true", default=False, help="Do not use the cache")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    motor = load_graph(args.graph, cache=not args.no_cache)
+    print(f"{len(motor.nodes)} nodes loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# --------------------------------------------------------------------------
+#
+# Time series recorder for the Python automation engine
+#
+# File:    pae_recorder.py
+# Author:  Peter Malmberg <peter.malmberg@gmail.com>
+# Date:
+# Version: 0.1
+# Python:  >=3.9
+# License: MIT
+#
+# ---------------------------------------------------------------------------
+#
+# Samples are buffered in memory and written in chunks of chunk_size rows.
+# A chunk holds a time column and one column per recorded node, every column
+# compressed on its own so a query only inflates the columns it reads. Both
+# files are append only, the index entry is written after its data so a
+# crash never leaves an index entry without data.
+#
+#   columns.json  node ids of the columns
+#   data.bin      compressed columns, chunk after chunk
+#   index.bin     per chunk: first time, last time, rows, offset and the
+#                 compressed length of each column
+#   tier<s>.bin   buckets of s seconds: start, count and min, max, mean of
+#                 every column, as doubles
+#
+# Buckets are appended when they are complete and written together with the
+# chunks. A bucket open when the recorder closes is written as well, if
+# recording resumes within it the records with the same start are merged
+# when queried.
+#
+
+from __future__ import annotations
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from pae import PaeMotor, PaeNode
+
+
+class PaeChunk:
+    def __init__(self, start: float, end: float, rows: int, offset: int, lengths: tuple) -> None:
+        self.start = start
+        self.end = end
+        self.rows = rows
+        self.offset = offset
+        self.lengths = lengths
+
+    def column(self, data, col: int) -> array:
+        """Column col of the chunk, 0 is the time column."""
+        pos = self.offset + sum(self.lengths[:col])
+        values = array("d")
+        values.frombytes(zlib.decompress(data[pos:pos + self.lengths[col]]))
+        return values
+
+
+class PaeTier:
+    """Buckets of min, max, mean and count of every column, maintained as
+    samples are recorded."""
+
+    def __init__(self, path: str, interval: float, columns: int) -> None:
+        self.path = path
+        self.interval = interval
+        self.columns = columns
+        self.width = 2 + 3 * columns
+        self.size = 8 * self.width
+        self.pending = array("d")
+        self.map = None
+        self.start = None
+        self.count = 0
+        self.mins = array("d", [0.0]) * columns
+        self.maxs = array("d", [0.0]) * columns
+        self.sums = array("d", [0.0]) * columns
+
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if size % self.size:
+            logging.warning(f"Recorder tier {path}: dropped torn bucket")
+            size -= size % self.size
+            with open(path, "r+b") as f:
+                f.truncate(size)
+        self.records = size // self.size
+
+    def add(self, now: float, values: list) -> None:
+        start = now - now % self.interval
+        mins, maxs, sums = self.mins, self.maxs, self.sums
+        if start != self.start:
+            self.close_bucket()
+            self.start = start
+            self.count = 0
+            for i, v in enumerate(values):
+                mins[i] = maxs[i] = sums[i] = v
+        else:
+            for i, v in enumerate(values):
+                if v < mins[i]:
+                    mins[i] = v
+                if v > maxs[i]:
+                    maxs[i] = v
+                sums[i] += v
+        self.count += 1
+
+    def bucket(self) -> array:
+        rec = array("d", (self.start, self.count))
+        for i in range(self.columns):
+            rec.extend((self.mins[i], self.maxs[i], self.sums[i] / self.count))
+        return rec
+
+    def close_bucket(self) -> None:
+        if self.start is not None:
+            self.pending.extend(self.bucket())
+            self.start = None
+
+    def flush(self, final: bool = False) -> None:
+        if final:
+            self.close_bucket()
+        if not self.pending:
+            return
+        with open(self.path, "ab") as f:
+            f.write(self.pending.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.records += len(self.pending) // self.width
+        self.pending = array("d")
+
+    def data(self):
+        if self.map is None or len(self.map) < self.records * self.size:
+            if self.map is not None:
+                self.map.close()
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def first(self, data, start: float) -> int:
+        """Index of the first stored bucket ending after start."""
+        lo, hi = 0, self.records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from("<d", data, mid * self.size)[0] + self.interval <= start:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, col: int, start: float, end: float) -> tuple:
+        """Start, min, max, mean and count of the buckets of column col
+        overlapping start to end, col counted from 1."""
+        out = tuple(array("d") for _ in range(5))
+        times, mins, maxs, means, counts = out
+        pos = 16 + 24 * (col - 1)
+
+        def add(t: float, n: float, mn: float, mx: float, mean: float) -> None:
+            if t + self.interval <= start or t > end:
+                return
+            if times and times[-1] == t:
+                total = counts[-1] + n
+                means[-1] = (means[-1] * counts[-1] + mean * n) / total
+                counts[-1] = total
+                mins[-1] = min(mins[-1], mn)
+                maxs[-1] = max(maxs[-1], mx)
+                return
+            times.append(t)
+            counts.append(n)
+            mins.append(mn)
+            maxs.append(mx)
+            means.append(mean)
+
+        if self.records:
+            data = self.data()
+            for i in range(self.first(data, start), self.records):
+                t, n = struct.unpack_from("<dd", data, i * self.size)
+                if t > end:
+                    break
+                add(t, n, *struct.unpack_from("<3d", data, i * self.size + pos))
+
+        pending = self.pending
+        for i in range(0, len(pending), self.width):
+            p = i + pos // 8
+            add(pending[i], pending[i + 1], pending[p], pending[p + 1], pending[p + 2])
+        if self.start is not None:
+            i = col - 1
+            add(self.start, self.count, self.mins[i], self.maxs[i], self.sums[i] / self.count)
+        return out
+
+    def close(self) -> None:
+        self.flush(final=True)
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class PaeRecorder:
+    """Record node values of a motor to a directory.
+
+    Call record() after each motor update, a sample is stored when interval
+    seconds have passed since the last one. query() returns the samples of
+    one node in a time range, including samples not yet written. history()
+    returns buckets from the coarsest tier that still gives one bucket per
+    pixel of a chart, or the raw samples if no tier is fine enough.
+    """
+
+    def __init__(
+        self,
+        motor: PaeMotor,
+        path: str,
+        nodes: list = None,
+        chunk_size: int = 3600,
+        interval: float = 0.0,
+        tiers: tuple = (60.0, 3600.0, 86400.0),
+        clock=time.time,
+    ) -> None:
+        self.motor = motor
+        self.path = path
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.clock = clock
+        self.last = None
+
+        os.makedirs(path, exist_ok=True)
+        columns_path = os.path.join(path, "columns.json")
+        if nodes is None:
+            nodes = [node for node in motor.nodes if node.id != ""]
+        self.nodes = [motor.find_node(n) if isinstance(n, str) else n for n in nodes]
+        ids = [node.id for node in self.nodes]
+
+        if os.path.exists(columns_path):
+            with open(columns_path) as f:
+                stored = json.load(f)
+            if stored != ids:
+                raise ValueError(f"Recorder {path} holds columns {stored}, not {ids}")
+        else:
+            with open(columns_path, "w") as f:
+                json.dump(ids, f)
+
+        self.columns = {id: i + 1 for i, id in enumerate(ids)}
+        self.index_format = f"<ddIQ{len(ids) + 1}I"
+        self.index_size = struct.calcsize(self.index_format)
+        self.data_path = os.path.join(path, "data.bin")
+        self.index_path = os.path.join(path, "index.bin")
+        self.chunks = self.read_index()
+        self.data_size = self.chunks[-1].offset + sum(self.chunks[-1].lengths) if self.chunks else 0
+        self.drop_torn_data()
+        self.map = None
+        self.buffer = [array("d") for _ in range(len(ids) + 1)]
+        self.tiers = [
+            PaeTier(os.path.join(path, f"tier{interval:g}.bin"), interval, len(ids))
+            for interval in sorted(tiers)
+        ]
+
+    def read_index(self) -> list[PaeChunk]:
+        chunks = []
+        try:
+            with open(self.index_path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return chunks
+
+        complete = len(raw) - len(raw) % self.index_size
+        if complete != len(raw):
+            logging.warning(f"Recorder {self.path}: dropped torn index entry")
+            with open(self.index_path, "r+b") as f:
+                f.truncate(complete)
+        for entry in struct.iter_unpack(self.index_format, raw[:complete]):
+            start, end, rows, offset, *lengths = entry
+            chunks.append(PaeChunk(start, end, rows, offset, tuple(lengths)))
+        return chunks
+
+    def drop_torn_data(self) -> None:
+        """Truncate data written without its index entry."""
+        try:
+            size = os.path.getsize(self.data_path)
+        except FileNotFoundError:
+            return
+        if size > self.data_size:
+            logging.warning(f"Recorder {self.path}: dropped torn chunk data")
+            with open(self.data_path, "r+b") as f:
+                f.truncate(self.data_size)
+
+    def record(self) -> None:
+        now = self.clock()
+        if self.last is not None and now - self.last < self.interval:
+            return
+        self.last = now
+
+        values = [node.value for node in self.nodes]
+        buffer = self.buffer
+        buffer[0].append(now)
+        for col, v in enumerate(values, 1):
+            buffer[col].append(v)
+        for tier in self.tiers:
+            tier.add(now, values)
+
+        if len(buffer[0]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered samples as one chunk, and the completed buckets."""
+        for tier in self.tiers:
+            tier.flush()
+
+        rows = len(self.buffer[0])
+        if rows == 0:
+            return
+
+        blobs = [zlib.compress(column.tobytes()) for column in self.buffer]
+        chunk = PaeChunk(
+            self.buffer[0][0], self.buffer[0][-1], rows, self.data_size, tuple(len(b) for b in blobs)
+        )
+        with open(self.data_path, "ab") as f:
+            f.write(b"".join(blobs))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.index_path, "ab") as f:
+            f.write(
+                struct.pack(self.index_format, chunk.start, chunk.end, rows, chunk.offset, *chunk.lengths)
+            )
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.chunks.append(chunk)
+        self.data_size += sum(chunk.lengths)
+        self.buffer = [array("d") for _ in self.buffer]
+
+    def data(self):
+        """Memory map of the data file, remapped when it has grown."""
+        if self.map is None or len(self.map) < self.data_size:
+            if self.map is not None:
+                self.map.close()
+            with open(self.data_path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def query(self, node: PaeNode | str, start: float, end: float) -> tuple[array, array]:
+        """Times and values of a node from start to end, inclusive."""
+        col = self.columns[node if isinstance(node, str) else node.id]
+        times, values = array("d"), array("d")
+
+        first = bisect_left([chunk.end for chunk in self.chunks], start)
+        if first < len(self.chunks):
+            data = self.data()
+            for chunk in self.chunks[first:]:
+                if chunk.start > end:
+                    break
+                t = chunk.column(data, 0)
+                v = chunk.column(data, col)
+                lo = bisect_left(t, start)
+                hi = bisect_left(t, end, lo)
+                while hi < len(t) and t[hi] <= end:
+                    hi += 1
+                times.extend(t[lo:hi])
+                values.extend(v[lo:hi])
+
+        t = self.buffer[0]
+        lo = bisect_left(t, start)
+        for i in range(lo, len(t)):
+            if t[i] > end:
+                break
+            times.append(t[i])
+            values.append(self.buffer[col][i])
+        return times, values
+
+    def history(self, node: PaeNode | str, start: float, end: float, width: int) -> tuple:
+        """Times, min, max, mean and count of a node from start to end for a
+        chart width pixels wide. Raw samples have a count of 1."""
+        col = self.columns[node if isinstance(node, str) else node.id]
+        for tier in reversed(self.tiers):
+            if (end - start) / tier.interval >= width:
+                return tier.query(col, start, end)
+
+        times, values = self.query(node, start, end)
+        return times, values, values, values, array("d", [1.0]) * len(values)
+
+    def close(self) -> None:
+        self.flush()
+        for tier in self.tiers:
+            tier.close()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
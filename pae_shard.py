@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# --------------------------------------------------------------------------
+#
+# Multi-process sharded motor for the Python automation engine
+#
+# File:    pae_shard.py
+# Author:  Peter Malmberg <peter.malmberg@gmail.com>
+# Date:
+# Version: 0.1
+# Python:  >=3.9
+# License: MIT
+#
+# ---------------------------------------------------------------------------
+
+from __future__ import annotations
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+from pae import PaeMotor, PaeNode
+
+
+class PaeShard:
+    """Nodes evaluated by one worker process.
+
+    phases holds one (imports, plan, exports) tuple per phase, imports and
+    exports are (rank, node) pairs of values read from and written to shared
+    memory around the plan.
+    """
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.nodes = []
+        self.phases = []
+        self.process = None
+        self.conn = None
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+class PaeShardAlarms:
+    """Alarm log of a worker, collecting the events for the parent."""
+
+    def __init__(self, rank: dict) -> None:
+        self.rank = rank
+        self.events = []
+
+    def event(self, node: PaeNode, value: float) -> None:
+        self.events.append((self.rank[node], value))
+
+
+class PaeShardedMotor(PaeMotor):
+    """PaeMotor evaluating its graph in worker processes.
+
+    The graph is split into weakly connected components, references to
+    boundary nodes are cut so a component can be split further. Components
+    are spread over the workers by size. Every node has a float slot in
+    shared memory. A node reading a node in another shard is placed in a
+    later phase than its producer and the workers pass a barrier between
+    phases, so each tick gives the same values as the single process
+    motor, except for Random nodes that draw from per-process generators.
+
+    Workers are forked and hold the live node state. After each update()
+    the values are copied back into the node objects of this process,
+    unless sync is False, then sync() does it on demand. fetch() copies
+    the full state, as for a checkpoint. Calls changing the state of a node
+    here, as set_state(), trigger() and autotune(), are replayed by its
+    worker before the next tick, compiling a node starts new workers.
+
+    Alarm events of the workers are sent back with their reply and passed
+    to the alarm log of this process after the tick.
+
+    An exception in a worker stops all of them and is raised by update(),
+    the next update() starts new workers from the state of this process.
+    Workers not reaching a barrier or answering within timeout seconds are
+    taken as failed.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        boundaries: list = (),
+        sync: bool = True,
+        clock=time.monotonic,
+        timeout: float = 10.0,
+    ) -> None:
+        super().__init__(clock=clock)
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.boundaries = list(boundaries)
+        self.sync_values = sync
+        self.timeout = timeout
+        self.calls = []
+        self.shards = []
+        self.shard_of = []
+        self.shared = None
+        self.values = None
+        self.barrier = None
+
+    def add_boundary(self, node: PaeNode | str) -> None:
+        self.boundaries.append(node)
+        self.plan = None
+
+    def mark_dirty(self, node: PaeNode) -> None:
+        self.dirty.add(node)
+
+    def mark_changed(self, node: PaeNode, method: str, *args) -> None:
+        if method == "compile":
+            if self.shards:
+                self.plan = None
+            return
+        self.dirty.add(node)
+        self.calls.append((node, method, args))
+
+    def partition(self) -> list[list[int]]:
+        """Weakly connected components, as lists of ranks, not joining
+        nodes through references to boundary nodes."""
+        cut = set()
+        for b in self.boundaries:
+            node = self.find_node(b) if isinstance(b, str) else b
+            if node is None:
+                raise ValueError(f"Unknown boundary node '{b}'")
+            cut.add(node)
+
+        parent = list(range(len(self.order)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, node in enumerate(self.order):
+            for d in node.dependencies():
+                if d in self.rank and d not in cut:
+                    a, b = find(i), find(self.rank[d])
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+
+        components = {}
+        for i in range(len(self.order)):
+            components.setdefault(find(i), []).append(i)
+        return list(components.values())
+
+    def compile(self) -> None:
+        self.fetch()
+        self.stop()
+        self.calls = []
+        for node in self.nodes:
+            node.compile()
+
+        self.order = self.sort()
+        self.rank = {node: i for i, node in enumerate(self.order)}
+        n = len(self.order)
+
+        shards = [PaeShard(i) for i in range(max(min(self.workers, n), 1))]
+        shard_of = [0] * n
+        for component in sorted(self.partition(), key=len, reverse=True):
+            shard = min(shards, key=len)
+            for i in component:
+                shard_of[i] = shard.index
+            shard.nodes.extend(component)
+        self.shards = [shard for shard in shards if len(shard) > 0]
+        for index, shard in enumerate(self.shards):
+            shard.index = index
+            shard.nodes.sort()
+            for i in shard.nodes:
+                shard_of[i] = index
+        self.shard_of = shard_of
+
+        phase = [0] * n
+        exported = set()
+        for i, node in enumerate(self.order):
+            for d in node.dependencies():
+                j = self.rank.get(d)
+                if j is not None and shard_of[j] != shard_of[i]:
+                    phase[i] = max(phase[i], phase[j] + 1)
+                    exported.add(j)
+                elif j is not None:
+                    phase[i] = max(phase[i], phase[j])
+        phases = max(phase, default=0) + 1
+
+        for shard in self.shards:
+            for p in range(phases):
+                members = [i for i in shard.nodes if phase[i] == p]
+                imports = {}
+                for i in members:
+                    for d in self.order[i].dependencies():
+                        j = self.rank.get(d)
+                        if j is not None and shard_of[j] != shard.index:
+                            imports[j] = d
+                shard.phases.append(
+                    (
+                        list(imports.items()),
+                        [self.order[i].update for i in members],
+                        [(i, self.order[i]) for i in members if i in exported],
+                    )
+                )
+
+        self.shared = SharedMemory(create=True, size=max(n, 1) * 8)
+        self.values = self.shared.buf.cast("d")
+        for i, node in enumerate(self.order):
+            self.values[i] = node.value
+
+        self.plan = [self.step]
+        self.dirty = set(self.order)
+        self.start_workers()
+
+    def start_workers(self) -> None:
+        ctx = multiprocessing.get_context("fork")
+        self.barrier = ctx.Barrier(len(self.shards), timeout=self.timeout)
+        for shard in self.shards:
+            shard.conn, child = ctx.Pipe()
+            shard.process = ctx.Process(target=self.worker, args=(shard, child), daemon=True)
+            shard.process.start()
+            child.close()
+        logging.debug("Started %d shard workers", len(self.shards))
+
+    def worker(self, shard: PaeShard, conn) -> None:
+        values = self.values
+        nodes = [(i, self.order[i]) for i in shard.nodes]
+        alarms = self.alarm_log = PaeShardAlarms(self.rank)
+        try:
+            while True:
+                msg = conn.recv()
+                if msg is None:
+                    break
+                if msg == "state":
+                    conn.send([(i, node.get_state()) for i, node in nodes])
+                    continue
+
+                self.time, calls, writes = msg
+                for i, method, args in calls:
+                    getattr(self.order[i], method)(*args)
+                self.calls.clear()
+                self.dirty.clear()
+                for i, new_value, enabled in writes:
+                    node = self.order[i]
+                    node.enabled = enabled
+                    if new_value is not None:
+                        node.new_value = new_value
+
+                for imports, plan, exports in shard.phases:
+                    for i, node in imports:
+                        node.value = values[i]
+                    for update in plan:
+                        update()
+                    for i, node in exports:
+                        values[i] = node.value
+                    self.barrier.wait()
+
+                for i, node in nodes:
+                    values[i] = node.value
+                conn.send(alarms.events)
+                alarms.events = []
+        except Exception as e:
+            if not isinstance(e, threading.BrokenBarrierError):
+                logging.exception(f"Shard worker {shard.index}")
+            self.barrier.abort()
+            try:
+                conn.send(e)
+            except Exception:
+                conn.send(RuntimeError(f"Shard worker {shard.index}: {e!r}"))
+        finally:
+            conn.close()
+
+    def receive(self, shard: PaeShard):
+        """Next message from a worker, an exception if it failed."""
+        conn = shard.conn
+        try:
+            while not conn.poll(self.timeout):
+                if not shard.process.is_alive():
+                    raise EOFError
+            return conn.recv()
+        except (EOFError, OSError):
+            return RuntimeError(f"Shard worker {shard.index} exited")
+
+    def request(self, msgs: list) -> list:
+        """Send one message to every worker and return the replies. If a
+        worker fails the workers are stopped and its exception is raised."""
+        try:
+            for shard, msg in zip(self.shards, msgs):
+                shard.conn.send(msg)
+        except OSError:
+            pass
+        replies = [self.receive(shard) for shard in self.shards]
+
+        errors = [r for r in replies if isinstance(r, BaseException)]
+        if errors:
+            self.stop()
+            self.plan = None
+            raise next(
+                (e for e in errors if not isinstance(e, threading.BrokenBarrierError)), errors[0]
+            )
+        return replies
+
+    def step(self) -> None:
+        calls = [[] for _ in self.shards]
+        for node, method, args in self.calls:
+            i = self.rank.get(node)
+            if i is not None:
+                calls[self.shard_of[i]].append((i, method, args))
+        self.calls = []
+
+        writes = [[] for _ in self.shards]
+        for node in self.dirty:
+            i = self.rank.get(node)
+            if i is None:
+                continue
+            writes[self.shard_of[i]].append((i, node.new_value, node.enabled))
+            node.new_value = None
+        self.dirty.clear()
+
+        replies = self.request(
+            [(self.time, calls[shard.index], writes[shard.index]) for shard in self.shards]
+        )
+        if self.sync_values:
+            self.sync()
+
+        if self.alarm_log is not None:
+            for events in replies:
+                for i, value in events:
+                    node = self.order[i]
+                    node.value = self.values[i]
+                    self.alarm_log.event(node, value)
+
+    def fetch(self) -> None:
+        """Copy the full state of the nodes from the workers. Nodes with
+        changes not yet sent to their worker keep their state."""
+        if not self.shards:
+            return
+        pending = {node for node, _, _ in self.calls}
+        calls, self.calls = self.calls, []
+        for reply in self.request(["state"] * len(self.shards)):
+            for i, state in reply:
+                node = self.order[i]
+                if node not in pending:
+                    node.set_state(state)
+        self.calls = calls
+
+    def sync(self) -> None:
+        """Copy the values computed by the workers into the nodes."""
+        values = self.values
+        for i, node in enumerate(self.order):
+            node.value = values[i]
+
+    def stop(self) -> None:
+        """Stop the workers and release the shared memory."""
+        for shard in self.shards:
+            if shard.process is not None and shard.process.is_alive():
+                try:
+                    shard.conn.send(None)
+                except OSError:
+                    pass
+                shard.process.join(self.timeout)
+                if shard.process.is_alive():
+                    logging.warning(f"Shard worker {shard.index} not responding, terminated")
+                    shard.process.terminate()
+                    shard.process.join()
+            if shard.conn is not None:
+                shard.conn.close()
+        self.shards = []
+        if self.shared is not None:
+            self.values.release()
+            self.values = None
+            self.shared.close()
+            self.shared.unlink()
+            self.shared = None
+
+    def __del__(self) -> None:
+        self.stop()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# --------------------------------------------------------------------------
+#
+# Simulation and replay for the Python automation engine
+#
+# File:    pae_sim.py
+# Author:  Peter Malmberg <peter.malmberg@gmail.com>
+# Date:
+# Version: 0.1
+# Python:  >=3.9
+# License: MIT
+#
+# ---------------------------------------------------------------------------
+#
+# A simulation runs a motor on a virtual clock, jumping straight to the next
+# deadline of its scheduler instead of sleeping. Inputs are functions of the
+# time or recorded (time, value) samples, and the motor generator is
+# seeded, so a run with the same seed and inputs gives the same output.
+#
+#   pae_sim.py pthermostat.json --duration 604800 --input temp=temp.csv
+#
+
+from __future__ import annotations
+import argparse
+import csv
+import time
+from pae import PaeMotor, PaeNode, PaeScheduler
+
+
+class PaeVirtualClock:
+    """Clock that only moves when advanced."""
+
+    def __init__(self, start: float = 0.0) -> None:
+        self.time = start
+
+    def __call__(self) -> float:
+        return self.time
+
+    def advance(self, dt: float) -> None:
+        self.time += dt
+
+
+class PaeSimInput:
+    """Values fed to a node, from a function of the time or from samples
+    held until the next one."""
+
+    def __init__(self, node: PaeNode, source) -> None:
+        self.node = node
+        if callable(source):
+            self.func = source
+            self.samples = None
+        else:
+            self.func = None
+            self.samples = sorted(source)
+        self.pos = 0
+
+    def feed(self, now: float) -> None:
+        if self.func is not None:
+            self.node.set_value(self.func(now))
+            return
+
+        samples = self.samples
+        pos = self.pos
+        while pos < len(samples) and samples[pos][0] <= now:
+            pos += 1
+        if pos != self.pos:
+            self.node.set_value(samples[pos - 1][1])
+            self.pos = pos
+
+
+class PaeSimulation:
+    """Run a motor as fast as possible on a virtual clock.
+
+    The clock starts at start, set it to the first time of recorded inputs
+    to replay them. Nodes run at their own interval as with PaeScheduler,
+    nodes without one every step seconds. Observers are called with the
+    motor after every cycle, a PaeRecorder given the same clock can record
+    the run. A node with a longer interval does not slow down the others:
+
+    >>> motor = PaeMotor()
+    >>> temp = motor.add_node(PaeNode(id="temp"))
+    >>> poll = motor.add_node(PaeNode(id="poll", interval=10.0))
+    >>> PaeSimulation(motor, step=1.0).run(100.0)
+    100
+    """
+
+    def __init__(self, motor: PaeMotor, step: float = 1.0, seed: int = 0, start: float = 0.0) -> None:
+        self.motor = motor
+        self.clock = PaeVirtualClock(start)
+        motor.clock = self.clock
+        motor.start = None
+        motor.rng.seed(seed)
+        self.scheduler = PaeScheduler(motor, step, self.clock)
+        self.inputs = []
+        self.observers = []
+
+    def add_input(self, node: PaeNode | str, source) -> PaeSimInput:
+        if isinstance(node, str):
+            found = self.motor.find_node(node)
+            if found is None:
+                raise ValueError(f"Unknown input node '{node}'")
+            node = found
+        sim_input = PaeSimInput(node, source)
+        self.inputs.append(sim_input)
+        return sim_input
+
+    def add_observer(self, observer) -> None:
+        self.observers.append(observer)
+
+    def run(self, duration: float, path: str = None, nodes: list = None) -> int:
+        """Run for duration seconds of virtual time, return the number of
+        cycles. With path the time and the node values after every cycle
+        are written to it as CSV, for nodes or every node with id."""
+        motor = self.motor
+        clock = self.clock
+        if nodes is None:
+            nodes = [node for node in motor.nodes if node.id != ""]
+        nodes = [motor.find_node(n) if isinstance(n, str) else n for n in nodes]
+
+        out = open(path, "w", newline="") if path is not None else None
+        try:
+            writer = None
+            if out is not None:
+                writer = csv.writer(out)
+                writer.writerow(["time"] + [node.id for node in nodes])
+
+            end = clock.time + duration
+            cycles = 0
+            while clock.time < end:
+                now = clock.time
+                for sim_input in self.inputs:
+                    sim_input.feed(now)
+                delay = self.scheduler.poll()
+                cycles += 1
+                for observer in self.observers:
+                    observer(motor)
+                if writer is not None:
+                    writer.writerow([now] + [node.value for node in nodes])
+                clock.advance(delay)
+        finally:
+            if out is not None:
+                out.close()
+        return cycles
+
+
+def read_samples(path: str) -> list[tuple[float, float]]:
+    """(time, value) samples from a CSV file, rows that are not two numbers
+    such as a header are skipped."""
+    samples = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            try:
+                samples.append((float(row[0]), float(row[1])))
+            except (IndexError, ValueError):
+                continue
+    return samples
+
+
+def main() -> None:
+    from pae_graph import load_graph
+
+    parser = argparse.ArgumentParser(description="Simulate a pae graph on a virtual clock")
+    parser.add_argument("graph", help="JSON or TOML graph file")
+    parser.add_argument("--duration", type=float, required=True, help="Seconds of virtual time")
+    parser.add_argument("--step", type=float, default=1.0, help="Tick interval in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--start", type=float, default=None, help="Start time, default first input sample")
+    parser.add_argument(
+        "--input", action="append", default=[], metavar="ID=CSV", help="Feed node ID from a time,value file"
+    )
+    parser.add_argument("--output", type=str, default=None, help="CSV file for the node values")
+    args = parser.parse_args()
+
+    motor = load_graph(args.graph)
+    inputs = []
+    for spec in args.input:
+        id, sep, path = spec.partition("=")
+        if not sep:
+            parser.error(f"--input expects ID=CSV, got '{spec}'")
+        inputs.append((id, read_samples(path)))
+
+    start = args.start
+    if start is None:
+        start = min((t for _, samples in inputs for t, _ in samples), default=0.0)
+
+    sim = PaeSimulation(motor, args.step, args.seed, start)
+    for id, samples in inputs:
+        sim.add_input(id, samples)
+
+    began = time.perf_counter()
+    cycles = sim.run(args.duration, args.output)
+    elapsed = time.perf_counter() - began
+    print(f"{cycles} cycles, {args.duration:.0f} s simulated in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
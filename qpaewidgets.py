@@ -16,7 +16,7 @@
 import logging
 import sys
 import time
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QObject, QSortFilterProxyModel, Qt, QTimer
 from PyQt5.QtGui import QCloseEvent
 from PyQt5.QtWidgets import (
     QApplication,
@@ -25,11 +25,14 @@ from PyQt5.QtWidgets import (
     QHBoxLayout,
     QVBoxLayout,
     QWidget,
-    QLabel,
     QPushButton,
     QCheckBox,
+    QComboBox,
+    QHeaderView,
     QLineEdit,
+    QTableView,
 )
+import numpy as np
 import pyqtgraph as pg
 from pae import PaeNode, PaeType, PaeMotor
 
@@ -45,6 +48,177 @@ pg_color_cyan = "#00ffff"
 pg_color_magenta = "#ff00ff"
 pg_color_orange = "#ffa500"
 
+class QPaeFrames(QObject):
+    """Redraws widgets at most fps times per second.
+
+    Widgets mark themselves stale when their data changes and get redraw()
+    called on the next frame, so any number of engine ticks between two
+    frames cost one redraw. Hidden widgets and widgets in a minimized
+    window stay stale until they are shown again.
+    """
+
+    def __init__(self, fps: float = 20.0, parent=None):
+        super().__init__(parent)
+        self.widgets = []
+        self.timer = QTimer(self)
+        self.timer.setInterval(int(1000 / fps))
+        self.timer.timeout.connect(self.frame)
+        self.timer.start()
+
+    def add(self, widget: QWidget) -> None:
+        self.widgets.append(widget)
+        widget.destroyed.connect(lambda: self.remove(widget))
+
+    def remove(self, widget: QWidget) -> None:
+        if widget in self.widgets:
+            self.widgets.remove(widget)
+
+    def frame(self) -> None:
+        for widget in self.widgets:
+            if widget.stale and widget.isVisible() and not widget.window().isMinimized():
+                widget.stale = False
+                widget.redraw()
+
+
+shared_frames = None
+
+
+def frames() -> QPaeFrames:
+    """Frame clock shared by the widgets of the application."""
+    global shared_frames
+    if shared_frames is None:
+        shared_frames = QPaeFrames()
+    return shared_frames
+
+
+class PaeRing:
+    """Fixed size history in a NumPy array, oldest sample first.
+
+    Samples are written twice, size apart, so the history is always one
+    contiguous view of the array that can be handed to pyqtgraph as is.
+    With rows the ring holds that many series sampled together, append()
+    then takes one value per row.
+    """
+
+    def __init__(self, size: int, initial=None, rows: int = None) -> None:
+        self.size = size
+        self.data = np.zeros(2 * size if rows is None else (rows, 2 * size))
+        if initial is not None:
+            self.data[..., :size] = initial
+            self.data[..., size:] = initial
+        self.pos = 0
+        self.count = size
+
+    def add_row(self) -> int:
+        """Add a series to a ring with rows, return its row."""
+        self.data = np.vstack((self.data, np.zeros((1, 2 * self.size))))
+        return len(self.data) - 1
+
+    def append(self, value) -> None:
+        pos = self.pos
+        self.data[..., pos] = value
+        self.data[..., pos + self.size] = value
+        pos += 1
+        self.pos = 0 if pos == self.size else pos
+        self.count += 1
+
+    def view(self, row: int = None) -> np.ndarray:
+        if row is None:
+            return self.data[self.pos:self.pos + self.size]
+        return self.data[row, self.pos:self.pos + self.size]
+
+
+class PaeDecimator:
+    """Min/max decimation of a curve for a plot some pixels wide.
+
+    The visible samples are split in buckets of a power of two samples,
+    at most one bucket per pixel, and each bucket is drawn as its minimum
+    and maximum in time order so spikes stay visible. Buckets are aligned
+    to the total sample count of the ring, so completed buckets never
+    change and are cached per bucket size, only new ones are computed.
+    """
+
+    levels = 8
+
+    def __init__(self, x: PaeRing, y: PaeRing, row: int = None) -> None:
+        self.x = x
+        self.y = y
+        self.row = row
+        self.cache = {}
+
+    def buckets(self, k: int, first: int, end: int, base: int) -> tuple:
+        xv, yv = self.x.view(), self.y.view(self.row)
+        i0 = first * k - base
+        data = yv[i0:i0 + (end - first) * k].reshape(-1, k)
+        amin, amax = data.argmin(axis=1), data.argmax(axis=1)
+        rows = np.arange(end - first) * k + i0
+        idx = np.stack((rows + np.minimum(amin, amax), rows + np.maximum(amin, amax)), axis=1).ravel()
+        return xv[idx], yv[idx]
+
+    def data(self, x0: float, x1: float, pixels: int) -> tuple:
+        """Points to draw for the x range x0 to x1."""
+        xv, yv = self.x.view(), self.y.view(self.row)
+        lo = max(int(np.searchsorted(xv, x0)) - 1, 0)
+        hi = min(int(np.searchsorted(xv, x1, side="right")) + 1, len(xv))
+        if hi - lo <= 2 * pixels:
+            return xv[lo:hi], yv[lo:hi]
+
+        k = 1 << int(np.ceil(np.log2((hi - lo) / pixels)))
+        base = self.y.count - self.y.size
+        b0 = -(-(base + lo) // k)
+        b1 = (base + hi) // k
+        if b1 <= b0:
+            return xv[lo:hi], yv[lo:hi]
+
+        entry = self.cache.get(k)
+        if entry is None or entry[0] > b0 or entry[1] < b0:
+            entry = (b0, b0, np.zeros(0), np.zeros(0))
+        cs, ce, cx, cy = entry
+        if ce < b1:
+            nx, ny = self.buckets(k, ce, b1, base)
+            cx, cy, ce = np.concatenate((cx, nx)), np.concatenate((cy, ny)), b1
+        # Buckets that left the ring
+        oldest = -(-base // k)
+        if oldest > cs:
+            cx, cy, cs = cx[2 * (oldest - cs):], cy[2 * (oldest - cs):], oldest
+
+        self.cache.pop(k, None)
+        self.cache[k] = (cs, ce, cx, cy)
+        if len(self.cache) > self.levels:
+            del self.cache[next(iter(self.cache))]
+
+        head, tail = slice(lo, b0 * k - base), slice(b1 * k - base, hi)
+        s, e = 2 * (b0 - cs), 2 * (b1 - cs)
+        return (
+            np.concatenate((xv[head], cx[s:e], xv[tail])),
+            np.concatenate((yv[head], cy[s:e], yv[tail])),
+        )
+
+
+def visible_range(plot: pg.PlotWidget, x: PaeRing) -> tuple:
+    """Visible x range and width in pixels of a plot, the whole history
+    while the x axis is auto ranged."""
+    vb = plot.getViewBox()
+    if vb.autoRangeEnabled()[0]:
+        xv = x.view()
+        x0, x1 = xv[0], xv[-1]
+    else:
+        x0, x1 = vb.viewRange()[0]
+    return x0, x1, max(int(vb.width()), 1)
+
+
+def watch_range(plot: pg.PlotWidget) -> None:
+    """Redraw a plot when it is zoomed, panned or resized by the user."""
+    vb = plot.getViewBox()
+
+    def changed(*args) -> None:
+        if not vb.autoRangeEnabled()[0]:
+            plot.stale = True
+
+    vb.sigXRangeChanged.connect(changed)
+    vb.sigResized.connect(changed)
+
+
 class QPaePlot(pg.PlotWidget):
     def __init__(self, node: PaeNode, datapoints=1000, intervall: int = 1, parent=None):
         super().__init__(background="default",
@@ -55,10 +229,14 @@ class QPaePlot(pg.PlotWidget):
         self.intervall = intervall
         self.tick = 0
         # self.setTitle(node.get_name())
-        self.x = [time.time() - (self.datapoints - i)*self.intervall for i in range(self.datapoints)]
-        self.y = [0 for _ in range(self.datapoints)]
+        self.x = PaeRing(datapoints, time.time() - (datapoints - np.arange(datapoints)) * intervall)
+        self.y = PaeRing(datapoints)
 
-        self.line = self.plot(self.x, self.y, pen=pen)
+        self.line = self.plot(self.x.view(), self.y.view(), pen=pen)
+        self.decimator = PaeDecimator(self.x, self.y)
+        self.stale = False
+        frames().add(self)
+        watch_range(self)
 
     def update(self):
         self.tick += 1
@@ -67,14 +245,22 @@ class QPaePlot(pg.PlotWidget):
             self.tick = 0
 
     def update_plot(self, new_val):
-        self.x.pop(0)
         self.x.append(time.time())
-        self.y.pop(0)
         self.y.append(new_val)
-        self.line.setData(self.x, self.y)
+        self.stale = True
+
+    def redraw(self) -> None:
+        self.line.setData(*self.decimator.data(*visible_range(self, self.x)))
 
 
 class QPaePlots(pg.PlotWidget):
+    """Plot of several nodes on one time axis.
+
+    The curves share one ring of sample times and keep their values as rows
+    of one ring, so sampling every curve is a single array write and the
+    curves always have as many points as the time axis.
+    """
+
     def __init__(self, nodes: PaeNode, datapoints=1000, intervall: int = 1, parent=None):
         super().__init__(background="default",
                          parent=parent,
@@ -84,26 +270,31 @@ class QPaePlots(pg.PlotWidget):
         self.intervall = intervall
         self.tick = 0
         # self.setTitle(node.get_name())
-        self.x = [time.time() - (self.datapoints - i)*self.intervall for i in range(self.datapoints)]
+        self.x = PaeRing(datapoints, time.time() - (datapoints - np.arange(datapoints)) * intervall)
+        self.y = PaeRing(datapoints, rows=0)
+        self.stale = False
+        frames().add(self)
+        watch_range(self)
 
     def add_node(self, node: PaeNode, color="#00ff00") -> None:   
-        y = [0 for _ in range(self.datapoints)]
+        row = self.y.add_row()
         pen = pg.mkPen(color=color, width=0.6)
-        line = self.plot(self.x, y, pen=pen)
+        line = self.plot(self.x.view(), self.y.view(row), pen=pen)
 
-        self.nodes.append((node, y, line))
+        self.nodes.append((node, line, PaeDecimator(self.x, self.y, row)))
 
     def update(self):
         self.tick += 1
-        self.x.pop(0)
-        self.x.append(time.time())
         if self.tick >= self.intervall:
-            for (node, y, line) in self.nodes:
-                y.pop(0)
-                y.append(node.value)
-                line.setData(self.x, y)
-
+            self.x.append(time.time())
+            self.y.append([node.value for (node, line, decimator) in self.nodes])
             self.tick = 0
+            self.stale = True
+
+    def redraw(self) -> None:
+        view = visible_range(self, self.x)
+        for (node, line, decimator) in self.nodes:
+            line.setData(*decimator.data(*view))
 
 
 class QPaeNode(QWidget):
@@ -156,7 +347,15 @@ class QPaeNode(QWidget):
 
         self.plot = QPaePlot(node=node, datapoints=500, intervall=0.1)
         self.main_layout.addWidget(self.plot)
-        self.update()
+        self.redraw()
+        self.stale = False
+        frames().add(self)
+
+        # Nodes outside a motor are redrawn on every update() instead
+        self.subscription = None
+        if node.motor is not None:
+            self.subscription = node.subscribe(self.refresh)
+        self.destroyed.connect(lambda: self.release())
 
     def node_enable_changed(self, state: int) -> None:
         logging.debug(f"Node {self.node.get_name()} enabled state changed: {state}")
@@ -165,8 +364,11 @@ class QPaeNode(QWidget):
         else:
             self.node.enable(False)
 
-    def update(self) -> None:
+    def refresh(self, node: PaeNode) -> None:
+        """Called when the node changes, the labels follow on the next frame."""
+        self.stale = True
 
+    def redraw(self) -> None:
         self.value_label.setText(f"{self.node.value:.3f}")
         if self.node.is_enabled() is True:
             enabled = "E"
@@ -182,75 +384,97 @@ class QPaeNode(QWidget):
             f"{enabled:1} {n_src:2}"
         )
 
+    def update(self) -> None:
+        if self.subscription is None:
+            self.stale = True
         self.plot.update()
 
+    def release(self) -> None:
+        """Stop following the node, when the widget is closed."""
+        if self.subscription is not None:
+            self.node.motor.unsubscribe(self.subscription)
+            self.subscription = None
+        frames().remove(self)
 
-class QPaeMonitorNode(QWidget):
+    def closeEvent(self, event: QCloseEvent) -> None:
+        self.release()
+        return super().closeEvent(event)
 
-    def add_label(self, text: str, width: int = 100) -> QLineEdit:
-        label = QLineEdit(self, text=text)
-        label.setReadOnly(True)
-        # label.setFixedWidth(width)
-        label.setMinimumWidth(width)
-        self.main_layout.addWidget(label)
-        return label
 
-    def add_qlabel(self, text: str, width: int = 100) -> QLabel:
-        label = QLabel(f"<b>{text}</b>", self)
-        label.setMinimumWidth(width)
-        self.main_layout.addWidget(label)
-        return label
+class PaeNodeModel(QAbstractTableModel):
+    """Table of the nodes of a motor.
 
-    def __init__(self, node: PaeNode, parent=None, header: bool = False):
-        super().__init__(parent)
+    Cells are only formatted when a view asks for them, so a view only
+    costs the rows it shows. Changed nodes are collected from subscriptions
+    and announced with one dataChanged per flush().
+    """
 
-        self.node = node
-        self.main_layout = QHBoxLayout(self)
-        self.main_layout.setSpacing(1)
-        self.main_layout.setContentsMargins(1, 1, 1, 1)
-        self.setLayout(self.main_layout)
+    columns = ("Name", "ID", "Type", "Source ID", "Flags", "Value")
+    flags_column = 4
+    value_column = 5
 
-        if header is True:
-            self.name_label = self.add_qlabel("Name", 150)
-            self.id_label = self.add_qlabel("ID", 120)
-            self.type_label = self.add_qlabel("Type", 140)
-            self.source_id = self.add_qlabel("Source ID", 120)
-            self.flags_label = self.add_qlabel("Flags", 60)
-            self.value_label = self.add_qlabel("Value", 100)
+    def __init__(self, motor: PaeMotor, parent=None):
+        super().__init__(parent)
+        self.motor = motor
+        self.nodes = list(motor.nodes)
+        self.rows = {node: i for i, node in enumerate(self.nodes)}
+        self.changed = set()
+        self.subscriptions = [motor.subscribe(node, self.node_changed) for node in self.nodes]
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.nodes)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section]
+        return None
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if role not in (Qt.DisplayRole, Qt.UserRole):
+            return None
+
+        node = self.nodes[index.row()]
+        column = index.column()
+        if column == self.value_column:
+            return node.value if role == Qt.UserRole else f"{node.value:.3f}"
+        if column == 0:
+            return node.get_name()
+        if column == 1:
+            return node.id
+        if column == 2:
+            return node.type.name
+        if column == 3:
+            return node.source.id if isinstance(node.source, PaeNode) else ""
+
+        enabled = "E" if node.is_enabled() is True else "D"
+        n_src = "SD" if node.source_enabled() is False else "  "
+        return f"{enabled:1} {n_src:2}"
+
+    def node_changed(self, node: PaeNode) -> None:
+        self.changed.add(self.rows[node])
+
+    def flush(self) -> None:
+        """Announce the rows changed since the last flush."""
+        if not self.changed:
             return
-
-        self.name_label = self.add_label(f"{self.node.get_name()}", 150)
-        self.id_label = self.add_label(f"{self.node.id}", 120)
-        self.type_label = self.add_label(f"{self.node.type.name}", 140)
-        if self.node.source is not None:
-            self.source_id = self.add_label(f"{self.node.source.id}", 120)
-        else:
-            self.source_id = self.add_label("", 120)
-        
-        self.flags_label = self.add_label("", 60)
-        self.value_label = self.add_label("", 100)
-
-        self.update()
-
-    def update(self) -> None:
-
-        self.value_label.setText(f"{self.node.value:.3f}")
-        if self.node.is_enabled() is True:
-            enabled = "E"
-        else:
-            enabled = "D"
-
-        if self.node.source_enabled() is False:
-            n_src = "SD"
-        else:
-            n_src = "  "
-
-        self.flags_label.setText(
-            f"{enabled:1} {n_src:2}"
+        first, last = min(self.changed), max(self.changed)
+        self.changed.clear()
+        self.dataChanged.emit(
+            self.index(first, self.flags_column), self.index(last, self.value_column)
         )
 
+    def close(self) -> None:
+        for sub in self.subscriptions:
+            self.motor.unsubscribe(sub)
+        self.subscriptions = []
+
 
 class QPaeMonitor(QDialog):
+    filters = {"All": -1, "Name": 0, "ID": 1, "Type": 2}
+
     def __init__(self, motor: PaeMotor, parent=None):
         super().__init__(parent)
         self.motor = motor
@@ -258,23 +482,73 @@ class QPaeMonitor(QDialog):
         self.setModal(False)
         self.setWindowModality(Qt.WindowModal)
         #self.setWindowModality(Qt.ApplicationModal)
+        self.resize(760, 500)
 
         self.main_layout = QVBoxLayout(self)
         self.main_layout.setContentsMargins(1, 1, 1, 1)
         self.main_layout.setSpacing(1)
         self.setLayout(self.main_layout)
 
-        self.main_layout.addWidget(QPaeMonitorNode(node=None, header=True))
+        self.filter_layout = QHBoxLayout()
+        self.main_layout.addLayout(self.filter_layout)
+        self.filter_column = QComboBox(self)
+        self.filter_column.addItems(self.filters.keys())
+        self.filter_column.currentTextChanged.connect(self.filter_column_changed)
+        self.filter_layout.addWidget(self.filter_column)
+        self.filter_text = QLineEdit(self)
+        self.filter_text.setPlaceholderText("Filter")
+        self.filter_text.setClearButtonEnabled(True)
+        self.filter_layout.addWidget(self.filter_text)
+
+        self.model = PaeNodeModel(motor, self)
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setSortRole(Qt.UserRole)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.proxy.setFilterKeyColumn(-1)
+        self.filter_text.textChanged.connect(self.proxy.setFilterFixedString)
+
+        self.view = QTableView(self)
+        self.view.setModel(self.proxy)
+        self.view.setSortingEnabled(True)
+        self.view.sortByColumn(-1, Qt.AscendingOrder)
+        self.view.verticalHeader().hide()
+        self.view.verticalHeader().setDefaultSectionSize(self.view.fontMetrics().height() + 4)
+        self.view.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        for column, width in enumerate((150, 120, 140, 120, 60)):
+            self.view.setColumnWidth(column, width)
+        self.main_layout.addWidget(self.view)
+
+        frames().add(self)
+
+    @property
+    def stale(self) -> bool:
+        return bool(self.model.changed)
+
+    @stale.setter
+    def stale(self, stale: bool) -> None:
+        # The model forgets its changes when flushed by redraw()
+        pass
+
+    def filter_column_changed(self, text: str) -> None:
+        self.proxy.setFilterKeyColumn(self.filters[text])
+
+    def redraw(self) -> None:
+        self.model.flush()
+
+    def release(self) -> None:
+        """Stop following the motor, when the dialog is closed."""
+        self.model.close()
+        frames().remove(self)
+
+    def done(self, result: int) -> None:
+        self.release()
+        super().done(result)
 
-        self.node_widgets = []
-        for nd in self.motor.nodes:
-            nw = QPaeMonitorNode(node=nd)
-            self.main_layout.addWidget(nw)
-            self.node_widgets.append(nw)
-
-    def update(self) -> None:
-        for nw in self.node_widgets:
-            nw.update()
+    def closeEvent(self, event: QCloseEvent) -> None:
+        self.release()
+        return super().closeEvent(event)
 
     @staticmethod
     def monitor(motor: PaeMotor) -> None:
@@ -303,14 +577,15 @@ class MainWindow(QMainWindow):
             PaeNode(
                 type=PaeType.Sine,
                 name="Sine",
-                id="sin")
+                id="sin",
+                period=12.0)
             )
         sqr_node = self.motor.add_node(
             PaeNode(
                 type=PaeType.Square,
                 name="Square",
                 id="sqr",
-                period=12.0
+                period=2.5
             )
         )
         sin_sqr_node = self.motor.add_node(
@@ -355,9 +630,6 @@ class MainWindow(QMainWindow):
 
         self.multi_plot.update()
 
-        if self.monitor is not None:
-            self.monitor.update()
-
     def exit(self):
         self.monitor.close()
         return super().close()  # Placeholder for any cleanup actions